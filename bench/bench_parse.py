@@ -0,0 +1,114 @@
+# Listing parser benchmark on saved SS.com pages (bench/fixtures/*.html).
+#
+# Compares the old per-cell heuristic parser with the header-driven parser
+# backends in bot.py: rows per second and field accuracy against the
+# expected values in the matching .json file.
+#
+#   python bench/bench_parse.py [--rounds 200]
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:bench')  # bots netiek palaists, tikai importēts
+import bot  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIELDS = ('title', 'url', 'model', 'year', 'engine', 'mileage', 'price')
+
+
+# Vecais parseris (pirms kolonnu virsrakstu kartes) - salīdzināšanai
+def parse_listing_legacy(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    ads = []
+    for row in soup.select('tr[id^="tr_"]:not(.head_line)'):
+        if 'bnr' in row.get('id', ''):
+            continue
+        title_elem = row.select_one('a.am')
+        ad_data = {
+            'ad_id': row.get('id').replace('tr_', ''),
+            'title': title_elem.text.strip() if title_elem else "No title",
+            'price': "Nav norādīta",
+            'year': "Nav norādīts",
+            'engine': "Nav norādīts",
+            'transmission': "Nav norādīta",
+            'date': "Nav norādīts",
+            'url': "https://www.ss.com" + title_elem['href'] if title_elem else ""
+        }
+        for td in row.select('td.msga2-o'):
+            text = td.text.strip()
+            if '€' in text:
+                ad_data['price'] = text
+            elif text.isdigit() and 1900 <= int(text) <= 2099:
+                ad_data['year'] = text
+            elif any(fuel in text.lower() for fuel in ['d', 'b', 'benzīns', 'dīzelis', 'benzins', 'dizelis', 'гибрид', 'hybrid']):
+                ad_data['engine'] = text
+            elif any(trans in text.lower() for trans in ['a', 'm', 'automāts', 'manuāla', 'automats', 'manuala', 'автомат', 'механика']):
+                ad_data['transmission'] = text
+            elif '.' in text and len(text) >= 8:
+                ad_data['date'] = text
+        # Pārveidojam teksta vērtības tipos, lai tās var salīdzināt ar sagaidāmajām
+        ad_data['year'] = bot.parse_year(ad_data['year'])
+        ad_data['price'] = bot.parse_price(ad_data['price'])
+        ad_data['engine'] = bot.parse_text(ad_data['engine']) if ad_data['engine'] != "Nav norādīts" else None
+        ads.append(ad_data)
+    return ads
+
+
+# Vecais parseris atgriež dict, bot.py parseri - bot.Ad
+def field_value(ad, field):
+    return ad.get(field) if isinstance(ad, dict) else getattr(ad, field, None)
+
+
+def accuracy(parser, pages):
+    correct = total = 0
+    for html, expected in pages:
+        parsed = {field_value(ad, 'ad_id'): ad for ad in parser(html)}
+        for exp in expected:
+            ad = parsed.get(exp['ad_id'], {})
+            for field in FIELDS:
+                if field in exp:
+                    total += 1
+                    correct += field_value(ad, field) == exp[field]
+    return correct / total if total else 0
+
+
+def throughput(parser, pages, rounds):
+    rows = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for html, _expected in pages:
+            rows += len(parser(html))
+    elapsed = time.perf_counter() - start
+    return rows / elapsed, elapsed / rows * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        with open(path[:-5] + '.json', encoding='utf-8') as f:
+            pages.append((html, json.load(f)))
+
+    parsers = [('legacy', parse_listing_legacy)]
+    parsers += sorted(bot.PARSER_BACKENDS.items())
+
+    print(f"{len(pages)} lapas, {args.rounds} atkārtojumi")
+    print(f"{'parseris':<10} {'rindas/s':>10} {'µs/rinda':>10} {'precizitāte':>12}")
+    for name, parse in parsers:
+        rows_per_sec, us_per_row = throughput(parse, pages, args.rounds)
+        print(f"{name:<10} {rows_per_sec:>10.0f} {us_per_row:>10.1f} {accuracy(parse, pages):>12.1%}")
+
+
+if __name__ == '__main__':
+    main()
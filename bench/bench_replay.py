@@ -0,0 +1,402 @@
+# Offline replay benchmark of the whole scrape/notify pipeline.
+#
+# Starts a local stand-in for SS.com that serves listing pages built from the
+# recorded pages in bench/fixtures/ (new ads appear between cycles, optional
+# latency) and a fake Telegram Bot API, then runs bot.run_cycle and the
+# notification dispatcher against them for 10, 1k and 10k searches.
+#
+# Reports cycle time, HTTP requests per second, parse µs per row, DB writes,
+# Telegram messages and peak memory. Searches and new ads come from a fixed
+# seed, so runs are comparable between revisions:
+#
+#   python bench/bench_replay.py --json base.json          # on the old revision
+#   python bench/bench_replay.py --compare base.json       # exit 1 on regression
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+SCENARIOS = {'10': 10, '1k': 1000, '10k': 10000}
+MAKES = ['audi', 'bmw', 'citroen', 'fiat', 'ford', 'honda', 'hyundai', 'kia', 'lexus', 'mazda',
+         'mercedes', 'mitsubishi', 'nissan', 'opel', 'peugeot', 'renault', 'skoda', 'subaru',
+         'toyota', 'volkswagen', 'volvo', 'seat', 'dacia', 'porsche', 'tesla']
+MODELS_PER_MAKE = 8
+PAGE_SIZE = 30
+LISTING_ADS = 5 * PAGE_SIZE
+
+# Salīdzinot ar bāzi: True - mazāk ir labāk
+COMPARED = {
+    'cycle_ms_mean': True,
+    'cycle_ms_p95': True,
+    'requests_per_s': False,
+    'parse_us_per_row': True,
+    'db_write_ms_per_cycle': True,
+    'telegram_msgs_per_s': False,
+    'peak_rss_mb': True,
+}
+
+
+# Ierakstītā lapa sadalīta: galva līdz pirmajam sludinājumam, sludinājumu rindas, beigas
+class PageTemplate:
+    def __init__(self, path):
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        rows = re.findall(r'<tr id="tr_\d+".*?</tr>\n?', html, re.S)
+        self.head = html[:html.index(rows[0])]
+        tail = html[html.index(rows[-1]) + len(rows[-1]):]
+        self.tail = re.sub(r'<div class="td2">.*?</div>\n?', '{nav}', tail, flags=re.S)
+        # Katram sludinājumam savs id un sava saite (citādi detaļu kešs trāpītu nereāli bieži)
+        self.rows = []
+        for row in rows:
+            template_id = re.search(r'id="tr_(\d+)"', row).group(1)
+            row = re.sub(r'(href="/msg/[^"]*?)\.html"', r'\1-%ID%.html"', row)
+            self.rows.append(row.replace(template_id, '%ID%'))
+
+    def render(self, ad_ids, next_page):
+        parts = [self.head]
+        for ad_id in ad_ids:
+            parts.append(self.rows[ad_id % len(self.rows)].replace('%ID%', str(ad_id)))
+        nav = (f'<div class="td2"><a name="nav_id" rel="next" class="navi" href="page{next_page}.html">'
+               f'Nākamie</a></div>\n' if next_page else '')
+        parts.append(self.tail.replace('{nav}', nav))
+        return ''.join(parts)
+
+
+# SS.com aizstājējs: katram markas/modeļa sarakstam sava sludinājumu virkne (jaunākie pirmie).
+# Filtri URL tiek ignorēti - filtrētā meklēšana saņem to pašu sarakstu.
+class FakeSS:
+    def __init__(self, seed, latency):
+        self.make_page = PageTemplate(os.path.join(FIXTURES, 'bmw.html'))      # ar kolonnu "Modelis"
+        self.model_page = PageTemplate(os.path.join(FIXTURES, 'bmw_x5.html'))
+        with open(os.path.join(FIXTURES, 'detail', 'bmw_x5.html'), encoding='utf-8') as f:
+            self.detail_page = f.read()
+        self.detail_requests = 0
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.listings = {}
+        self.next_id = 60000000
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+
+    def listing(self, key):
+        state = self.listings.get(key)
+        if state is None:
+            start = 50000000 + len(self.listings) * 1000
+            state = self.listings[key] = {'ids': list(range(start + LISTING_ADS, start, -1)), 'version': 0}
+        return state
+
+    # Katram `fraction` daļai sarakstu pievieno vienu jaunu sludinājumu
+    def tick(self, fraction):
+        with self.lock:
+            for key in sorted(self.listings):
+                if self.random.random() < fraction:
+                    state = self.listings[key]
+                    self.next_id += 1
+                    state['ids'].insert(0, self.next_id)
+                    state['version'] += 1
+
+    def page(self, path, etag):
+        if path.startswith('/msg/'):
+            with self.lock:
+                self.detail_requests += 1
+            return 200, self.detail_page, None
+        parts = [part for part in path.split('/lv/transport/cars/', 1)[-1].split('/') if part]
+        page_no = 1
+        if parts and parts[-1].startswith('page'):
+            page_no = int(re.sub(r'\D', '', parts.pop()) or 1)
+        if 'sell' in parts:
+            parts = parts[:parts.index('sell')]
+        with self.lock:
+            self.requests += 1
+            state = self.listing('/'.join(parts))
+            tag = f'"{state["version"]}-{page_no}"'
+            if etag == tag:
+                self.not_modified += 1
+                return 304, None, tag
+            ad_ids = state['ids'][(page_no - 1) * PAGE_SIZE:page_no * PAGE_SIZE]
+            more = len(state['ids']) > page_no * PAGE_SIZE
+        template = self.model_page if len(parts) > 1 else self.make_page
+        return 200, template.render(ad_ids, page_no + 1 if more else None), tag
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True   # citādi keep-alive atbildes aizkavējas par ~40 ms
+
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+                status, html, tag = fake.page(self.path, self.headers.get('If-None-Match'))
+                body = html.encode() if html else b''
+                self.send_response(status)
+                if tag:
+                    self.send_header('ETag', tag)
+                self.send_header('Content-Type', 'text/html; charset=UTF-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# Telegram Bot API aizstājējs: sendMessage atbild "ok" un skaita ziņas
+class FakeTelegram:
+    def __init__(self):
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True   # citādi keep-alive atbildes aizkavējas par ~40 ms
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with fake.lock:
+                    fake.messages += 1
+                    message_id = fake.messages
+                result = {'message_id': message_id, 'date': int(time.time()),
+                          'chat': {'id': 1, 'type': 'private'}, 'text': ''}
+                body = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def make_searches(count, seed):
+    rng = random.Random(seed)
+    searches = []
+    for i in range(count):
+        make = rng.choice(MAKES)
+        model = f"m{rng.randrange(MODELS_PER_MAKE)}" if rng.random() < 0.7 else ''
+        year_from = rng.choice((2005, 2010, 2015)) if rng.random() < 0.4 else None
+        price_to = rng.choice((5000, 10000, 20000)) if rng.random() < 0.3 else None
+        searches.append((i % max(count // 3, 1) + 1, 'cars', make, model, year_from, None, None, price_to))
+    return searches
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(name, args):
+    fake_ss = FakeSS(args.seed, args.latency / 1000)
+    fake_telegram = FakeTelegram()
+    ss_port = serve(fake_ss.handler())
+    telegram_port = serve(fake_telegram.handler())
+
+    workdir = tempfile.mkdtemp(prefix='bench_replay_')
+    os.environ.update({
+        'DB_PATH': os.path.join(workdir, 'bench.db'),
+        'TELEGRAM_BOT_TOKEN': '0:bench',
+        'SS_BASE_URL': f'http://127.0.0.1:{ss_port}',
+        'HOST_RATE': '1000000',
+        'HOST_BURST': '1000000',
+        'TELEGRAM_RATE': '1000000',
+        'TELEGRAM_CHAT_INTERVAL': '0',
+    })
+    sys.path.insert(0, ROOT)
+    import bot
+    from telebot import apihelper
+    apihelper.API_URL = f'http://127.0.0.1:{telegram_port}/bot{{0}}/{{1}}'
+    bot.init_app()
+
+    searches = make_searches(SCENARIOS[name], args.seed)
+    users = sorted({search[0] for search in searches})
+    tiers = ('free', 'premium', 'vip')
+    bot.db_writer.submit(lambda db: db.executemany(
+        "INSERT INTO users (user_id, subscription_type) VALUES (?, ?)",
+        [(user_id, tiers[user_id % 3]) for user_id in users])).result()
+    bot.db_writer.submit(lambda db: db.executemany('''
+    INSERT INTO searches (user_id, category, make, model, year_from, year_to, price_from, price_to)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', searches)).result()
+    bot.db_writer.submit(lambda db: bot.renew_leases(db, time.time())).result()
+    rows = bot.db_query(f"SELECT {bot.SEARCH_COLUMNS} FROM searches s WHERE s.lease_owner = ?", (bot.WORKER_ID,))
+    urls = {bot.search_url(row) for row in rows}
+
+    # Aukstais cikls: visi sludinājumi jauni; to paziņojumus izmetam, lai tie nesajauc mērījumus
+    start = time.perf_counter()
+    bot.run_cycle(rows)
+    bot.db_writer.flush()
+    cold_seconds = time.perf_counter() - start
+    bot.detail_enricher.flush()
+    bot.db_writer.flush()
+    cold_notifications = bot.db_writer.execute("DELETE FROM notifications").result()
+
+    def counter(name):
+        return sum(value for (key, _), value in bot.metrics.counters.items() if key == name)
+
+    def histogram(name):
+        value = bot.metrics.histograms.get((name, ()))
+        return (value[-2], value[-1]) if value else (0.0, 0)
+
+    requests_before = fake_ss.requests
+    detail_before = fake_ss.detail_requests
+    db_before = histogram('ss_db_write_seconds')
+    written_before = counter('ss_new_ads_total') + counter('ss_changed_ads_total')
+    cycle_times = []
+    telegram_seconds = 0.0
+    for _ in range(args.cycles):
+        fake_ss.tick(args.new_ads)
+        start = time.perf_counter()
+        bot.run_cycle(rows)
+        bot.db_writer.flush()
+        cycle_times.append(time.perf_counter() - start)
+        # Detaļas ārpus cikla - paziņojumi kļūst sūtāmi, kad tās ielādētas
+        bot.detail_enricher.flush()
+        bot.db_writer.flush()
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            if not bot.db_query_one("SELECT COUNT(*) FROM notifications WHERE next_attempt <= ?", (time.time(),))[0]:
+                break
+            bot.dispatcher.dispatch()
+        telegram_seconds += time.perf_counter() - start
+
+    requests = fake_ss.requests - requests_before
+    detail_requests = fake_ss.detail_requests - detail_before
+
+    # Parsēšanu mērām atsevišķi vienā pavedienā: cikla laikā fetch pavedieni sacenšas par GIL
+    pages = [fake_ss.page(url, None)[1] for url in sorted(urls)[:50]]
+    parsed_rows = 0
+    start = time.perf_counter()
+    for _ in range(20):
+        for html in pages:
+            parsed_rows += len(bot.parse_listing(html))
+    parse_seconds = time.perf_counter() - start
+    db_after = histogram('ss_db_write_seconds')
+    steady_seconds = sum(cycle_times)
+    return {
+        'scenario': name,
+        'searches': len(rows),
+        'urls': len(urls),
+        'cycles': args.cycles,
+        'cold_cycle_s': round(cold_seconds, 3),
+        'cold_notifications': cold_notifications,
+        'cycle_ms_mean': round(steady_seconds / len(cycle_times) * 1000, 2),
+        'cycle_ms_p95': round(percentile(cycle_times, 0.95) * 1000, 2),
+        'requests': requests,
+        'requests_per_s': round(requests / steady_seconds, 1),
+        'detail_requests': detail_requests,
+        'parse_us_per_row': round(parse_seconds / max(parsed_rows, 1) * 1e6, 2),
+        'db_writes_per_cycle': round((db_after[1] - db_before[1]) / len(cycle_times), 1),
+        'db_write_ms_per_cycle': round((db_after[0] - db_before[0]) / len(cycle_times) * 1000, 2),
+        'ads_written': counter('ss_new_ads_total') + counter('ss_changed_ads_total') - written_before,
+        'telegram_msgs': fake_telegram.messages,
+        'telegram_msgs_per_s': round(fake_telegram.messages / telegram_seconds, 1) if telegram_seconds else 0,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def print_results(results):
+    columns = ('scenario', 'searches', 'urls', 'cold_cycle_s', 'cycle_ms_mean', 'cycle_ms_p95', 'requests_per_s',
+               'detail_requests', 'parse_us_per_row', 'db_writes_per_cycle', 'db_write_ms_per_cycle', 'ads_written',
+               'telegram_msgs', 'telegram_msgs_per_s', 'peak_rss_mb')
+    for column in columns:
+        print(f"{column:<22}" + ''.join(f"{str(result[column]):>12}" for result in results))
+
+
+# Salīdzina ar iepriekšējo rezultātu; atgriež True, ja kāds rādītājs pasliktinājies vairāk par `threshold`
+def compare(results, baseline, threshold):
+    base = {result['scenario']: result for result in baseline['results']}
+    regressed = False
+    print(f"\nsalīdzinājums ar {baseline.get('revision') or 'bāzi'} (slieksnis {threshold:.0%})")
+    for result in results:
+        old = base.get(result['scenario'])
+        if not old:
+            continue
+        for metric, lower_is_better in COMPARED.items():
+            if not old.get(metric):
+                continue
+            change = result[metric] / old[metric] - 1
+            worse = change > threshold if lower_is_better else change < -threshold
+            regressed |= worse
+            print(f"{result['scenario']:>4} {metric:<22} {old[metric]:>10} -> {result[metric]:>10} "
+                  f"{change:>+8.1%}{'  REGRESIJA' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', default='10,1k,10k', help="komatiem atdalīti: 10, 1k, 10k")
+    parser.add_argument('--cycles', type=int, default=5, help="cikli pēc aukstā starta")
+    parser.add_argument('--new-ads', type=float, default=0.1, help="sarakstu daļa ar jaunu sludinājumu katrā ciklā")
+    parser.add_argument('--latency', type=float, default=0, help="SS.com atbildes aizture, ms")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="ierakstīt rezultātus šajā failā")
+    parser.add_argument('--compare', help="iepriekšējais --json rezultāts")
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    names = args.scenario.split(',')
+    if len(names) == 1:
+        # bot.py cikla žurnāls netiek rādīts - tikai kopsavilkums
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            results = [run_scenario(names[0], args)]
+    else:
+        # Katrs scenārijs savā procesā - bot.py stāvoklis un atmiņa netiek pārnesti
+        results = []
+        for name in names:
+            with tempfile.NamedTemporaryFile(suffix='.json') as out:
+                command = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--cycles', str(args.cycles),
+                           '--new-ads', str(args.new_ads), '--latency', str(args.latency), '--seed', str(args.seed),
+                           '--json', out.name]
+                subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+                results += json.load(open(out.name))['results']
+
+    print_results(results)
+    report = {'revision': revision(), 'python': sys.version.split()[0], 'args': vars(args), 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,239 +1,2620 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+try:
+    import lxml.html
+except ImportError:  # lxml nav obligāts - tad izmantojam BeautifulSoup
+    lxml = None
+try:
+    import numpy
+except ImportError:  # numpy nav obligāts - tirgus cenu kolonnas tad ir array masīvi
+    numpy = None
 import telebot
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, Update
+from telebot.apihelper import ApiTelegramException
 import sqlite3
+import sys
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import os
+import socket
+import signal
+import re
+import math
+import heapq
+import random
+import hashlib
+import statistics
+import unicodedata
+import threading
+from array import array
+from collections import Counter, OrderedDict
+import queue
+import itertools
+import functools
+import ssl
+import json
+import multiprocessing
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
 # Ielādēt vides mainīgos
 load_dotenv()
 
+# Telegram komandu apstrādes pavedieni (gan polling, gan webhook režīmā)
+HANDLER_THREADS = int(os.getenv('HANDLER_THREADS', 8))
+
 # Initialize bot
-bot = telebot.TeleBot(os.getenv('TELEGRAM_BOT_TOKEN'))
+bot = telebot.TeleBot(os.getenv('TELEGRAM_BOT_TOKEN'), num_threads=HANDLER_THREADS)
+
+# Fetch settings
+SS_BASE_URL = os.getenv('SS_BASE_URL', 'https://www.ss.com').rstrip('/')  # cits hosts - testiem/benchmarkiem
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 8))    # paralēli lejupielādējamās lapas
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', 10))         # sekundes (savienojums un lasīšana)
+HOST_RATE = float(os.getenv('HOST_RATE', 4))                  # pieprasījumi sekundē uz vienu hostu
+HOST_BURST = int(os.getenv('HOST_BURST', 8))
+USER_AGENT = os.getenv('USER_AGENT', 'Mozilla/5.0 (compatible; ss-tracker-bot)')
+PARSER_BACKEND = os.getenv('PARSER_BACKEND', 'auto')           # auto, lxml vai bs4
+MAX_PAGES = int(os.getenv('MAX_PAGES', 5))                    # cik lapas dziļi ejam vienā ciklā
+# Kļūdu izolācija: atkāpšanās (backoff) katram URL, ķēdes pārtraucējs (circuit breaker) katram hostam
+BACKOFF_BASE = float(os.getenv('BACKOFF_BASE', 30))           # sekundes pēc pirmās kļūdas, tālāk ×2
+BACKOFF_MAX = float(os.getenv('BACKOFF_MAX', 1800))
+HOST_BREAKER_THRESHOLD = int(os.getenv('HOST_BREAKER_THRESHOLD', 5))  # hosta kļūdas pēc kārtas līdz atvēršanai
+INVALID_PAUSE_AFTER = int(os.getenv('INVALID_PAUSE_AFTER', 3))  # 404 pēc kārtas, pēc kurām meklēšanu aptur
+# Jauno sludinājumu lapu (nobraukums, krāsa, VIN...) ielāde paziņojumiem
+ENRICH_DETAILS = os.getenv('ENRICH_DETAILS', '1') == '1'
+DETAIL_CONCURRENCY = int(os.getenv('DETAIL_CONCURRENCY', 3))  # paralēli lejupielādējamās sludinājumu lapas
+DETAIL_MAX_PER_CYCLE = int(os.getenv('DETAIL_MAX_PER_CYCLE', 50))  # pārējie paziņojumi - tikai ar saraksta datiem
+DETAIL_TTL = int(os.getenv('DETAIL_TTL', 6 * 3600))           # sekundes
+DETAIL_WAIT = float(os.getenv('DETAIL_WAIT', 30))             # cik ilgi paziņojums gaida detaļas, pēc tam sūtām bez tām
+DETAIL_CACHE_SIZE = 10000
+# Broad-crawl: katru markas/modeļa sarakstu lasām bez filtriem un gada/cenas filtrus pārbaudām lokāli
+BROAD_CRAWL = os.getenv('BROAD_CRAWL', '0') == '1'
+# Zem tirgus cenas: jaunu sludinājumu salīdzina ar sadaļas (marka/modelis) cenu mediānu tā paša gada ±1
+MARKET_DISCOUNT = float(os.getenv('MARKET_DISCOUNT', 0.15))   # cik lētāks par mediānu; 0 = izslēgts
+MARKET_MIN_SAMPLES = int(os.getenv('MARKET_MIN_SAMPLES', 8))  # mazāk sludinājumu - mediāna netiek ticēta
+MARKET_YEAR_SPAN = 1
+
+# Scheduler settings: (min, sākuma, max) intervāls sekundēs katram abonementam
+POLL_INTERVALS = {
+    'vip': (10, 30, 120),
+    'premium': (20, 60, 300),
+    'free': (30, 120, 600),
+}
+POLL_TARGET_NEW = float(os.getenv('POLL_TARGET_NEW', 1))      # cik jaunus sludinājumus gaidām vienā pārbaudē
+POLL_RATE_ALPHA = 0.3                                         # EWMA svars jaunākajam mērījumam
+POLL_JITTER = float(os.getenv('POLL_JITTER', 0.1))            # ±10% nejaušība pārbaudes laikam
+SEARCH_REFRESH = 10                                           # cik bieži pārlasa searches tabulu (s)
+SCHEDULE_SAVE_INTERVAL = int(os.getenv('SCHEDULE_SAVE_INTERVAL', 300))  # plānotājs un last_checked uz DB (s)
+
+# Telegram notification settings
+TELEGRAM_RATE = float(os.getenv('TELEGRAM_RATE', 25))         # ziņas sekundē visiem čatiem kopā (limits ~30)
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', 1.0))  # sekundes starp ziņām vienam čatam
+DIGEST_MAX_ADS = 10                                           # cik sludinājumu apvienot vienā ziņā
+NOTIFY_MAX_ATTEMPTS = 8
+
+# Webhook režīms: ja WEBHOOK_URL ir norādīts, Telegram sūta atjauninājumus uz mūsu HTTP serveri
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')                    # piem. https://bot.example.com/telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')              # pārbauda X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT', '')                  # TLS bez reverse proxy (arī pašparakstīts)
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY', '')
+
+# Worker sharding: katrs process (arī uz citiem hostiem) ņem meklēšanas uz nomu (lease)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+LEASE_TTL = int(os.getenv('LEASE_TTL', 60))                  # sekundes; nomu atjauno ik pēc SEARCH_REFRESH
+LEASE_SLACK = 5                                               # cik virs taisnīgās daļas drīkst turēt pirms atdot
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 10))   # sekundes cikla pabeigšanai un paziņojumu izsūtīšanai
+SCRAPER_ERROR_PAUSE = 5                                       # sekundes pirms atkārtot neizdevušos sinhronizāciju
+WORKER_RESTART_DELAY = 10                                     # worker procesu, kas beidzās, restartē ne biežāk
+
+# Seen-ad index settings
+SEEN_PER_SEARCH = max(int(os.getenv('SEEN_PER_SEARCH', 1000)), MAX_PAGES * 60)  # jābūt > redzamo rindu skaits
+SEEN_BLOOM_CAPACITY = int(os.getenv('SEEN_BLOOM_CAPACITY', 0))  # 0 = bez Bloom filtra
+
+# Maintenance: ads glabāšanas termiņš, arhīvs un inkrementāls vacuum
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', 3600))  # sekundes; 0 = izslēgts
+RETENTION_ADS = max(int(os.getenv('RETENTION_ADS', 1000)), MAX_PAGES * 60)  # jaunākie katrai meklēšanai paliek vienmēr
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))         # vecākus par šo (ārpus RETENTION_ADS) arhivē; 0 = pēc skaita
+ARCHIVE_PATH = os.getenv('ARCHIVE_PATH', 'ss_archive.db')     # tukšs = dzēst bez arhīva
+MAINTENANCE_SLICE = 500                                       # rindas vienā rakstītāja darbā
+MAINTENANCE_PAUSE = 0.05                                      # pauze starp darbiem, lai netraucētu ciklam
+VACUUM_PAGES = 200                                            # lapas vienā incremental_vacuum solī
+
+# Metrics, logs and profiling
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))              # 0 = bez /metrics; worker procesiem +1, +2...
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+LOG_JSON = os.getenv('LOG_JSON', '0') == '1'                  # 1 = strukturēti žurnāli (JSON rinda katram notikumam)
+PROFILE_SAMPLE_MS = float(os.getenv('PROFILE_SAMPLE_MS', 0))  # 0 = profilētājs izslēgts
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 5))              # cik lēnāko ciklu profilus paturēt
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+# Skaitītāji, laika histogrammas un mērītāji; /metrics atdod tos Prometheus teksta formātā
+TIMING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> vērtība
+        self.histograms = {}    # (name, labels) -> [skaits katrā bucket..., summa, skaits]
+        self.gauges = {}        # (name, labels) -> vērtība vai funkcija, ko izsauc nolasot
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(TIMING_BUCKETS) + 2)
+            for i, bound in enumerate(TIMING_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(value)) for key, value in self.histograms.items())
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+        
+        lines = []
+        typed = set()
+        def sample(kind, name, labels, value, suffix=''):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+            value = value if isinstance(value, int) else repr(float(value))
+            lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+        
+        for (name, labels), value in counters:
+            sample('counter', name, labels, value)
+        for (name, labels), value in gauges:
+            try:
+                value = value() if callable(value) else value
+            except Exception:
+                continue
+            sample('gauge', name, labels, value)
+        for (name, labels), histogram in histograms:
+            for bound, count in zip(TIMING_BUCKETS, histogram):
+                sample('histogram', name, labels + (('le', f'{bound:g}'),), count, '_bucket')
+            sample('histogram', name, labels + (('le', '+Inf'),), histogram[-1], '_bucket')
+            sample('histogram', name, labels, histogram[-2], '_sum')
+            sample('histogram', name, labels, histogram[-1], '_count')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+started_at = time.time()   # restarta līdz pirmajam ciklam/paziņojumam mērīšanai
+
+# Bota komandu apstrādes laiks - p99 jāpaliek zemam arī scrape cikla laikā
+def timed(command):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.timer('ss_command_seconds', command=command):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # nepiesārņojam žurnālu ar katru Prometheus pieprasījumu
+
+def start_metrics_server(port=METRICS_PORT):
+    if not port:
+        return
+    server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"Metrikas: http://{METRICS_HOST}:{port}/metrics")
+
+# Žurnāla notikums: parasti - cilvēkam lasāms teksts, ar LOG_JSON=1 - viena JSON rinda ar laukiem
+def log_event(event, message, **fields):
+    if LOG_JSON:
+        record = {'ts': round(time.time(), 3), 'event': event, 'worker': WORKER_ID}
+        record.update(fields)
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+    else:
+        print(message)
+
+# Izlases profilētājs: cikla laikā ik pēc PROFILE_SAMPLE_MS nolasa visu pavedienu stekus
+# un PROFILE_DIR patur PROFILE_KEEP lēnāko ciklu "folded" stekus (flamegraph.pl / speedscope formāts)
+class CycleProfiler:
+    def __init__(self, sample_ms, keep, directory):
+        self.interval = sample_ms / 1000
+        self.keep = keep
+        self.directory = directory
+        self.slowest = []   # heap: (ilgums, fails)
+
+    @contextmanager
+    def cycle(self, label):
+        if not self.interval:
+            yield
+            return
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(target=self.sample, args=(stacks, stop), name='profiler', daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            self.record(time.perf_counter() - start, stacks, label)
+
+    def sample(self, stacks, stop):
+        own_id = threading.get_ident()
+        names = {}
+        while not stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(stack))] += 1
+
+    def record(self, duration, stacks, label):
+        if len(self.slowest) >= self.keep and duration <= self.slowest[0][0]:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"cycle-{datetime.now():%Y%m%d-%H%M%S}-{duration * 1000:.0f}ms.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# {label}, {duration:.3f}s\n")
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        heapq.heappush(self.slowest, (duration, path))
+        if len(self.slowest) > self.keep:
+            _, old_path = heapq.heappop(self.slowest)
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+profiler = CycleProfiler(PROFILE_SAMPLE_MS, PROFILE_KEEP, PROFILE_DIR)
 
 # Database setup
-conn = sqlite3.connect('ss_tracker.db', check_same_thread=False)
-cursor = conn.cursor()
-
-# Create tables
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    user_id INTEGER PRIMARY KEY,
-    subscription_type TEXT DEFAULT 'free',
-    subscription_expiry DATE
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS searches (
-    search_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    category TEXT,
-    make TEXT,
-    model TEXT,
-    year_from INTEGER,
-    year_to INTEGER,
-    price_from INTEGER,
-    price_to INTEGER,
-    last_checked TIMESTAMP,
-    FOREIGN KEY(user_id) REFERENCES users(user_id)
-)
-''')
-
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS ads (
-    ad_id TEXT PRIMARY KEY,
+DB_PATH = os.getenv('DB_PATH', 'ss_tracker.db')
+
+def connect_db():
+    db = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    # Jaunai datubāzei jāuzstāda pirms WAL un tabulām; esošu pārveido `python bot.py vacuum`
+    db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    db.execute("PRAGMA journal_mode=WAL")     # lasītāji netraucē rakstītājam un otrādi
+    db.execute("PRAGMA synchronous=NORMAL")   # WAL režīmā drošs un daudz ātrāks par FULL
+    return db
+
+# Viens sludinājums var būt vairākās meklēšanās - atslēga ir (search_id, ad_id)
+ADS_SCHEMA = '''(
+    ad_id TEXT,
     search_id INTEGER,
     title TEXT,
-    price TEXT,
+    price INTEGER,
     url TEXT,
     date_posted TEXT,
     is_new BOOLEAN DEFAULT 1,
+    content_hash INTEGER,
+    first_seen REAL,
+    PRIMARY KEY (search_id, ad_id),
     FOREIGN KEY(search_id) REFERENCES searches(search_id)
-)
-''')
+)'''
 
-conn.commit()
+# Create tables - shēmas migrācijas: katra izpildās vienreiz, versija glabājas PRAGMA user_version.
+# Jaunas izmaiņas pievieno kā jaunu funkciju MIGRATIONS beigās - esošās nemaina.
 
-# SS.com scraping function
-def scrape_ss(category, make, model, year_from=None, year_to=None, price_from=None, price_to=None):
-    base_url = "https://www.ss.com/lv/transport/cars/"
-    url = f"{base_url}{make}/{model}/"
+# 1: sākotnējā shēma (idempotenta - pielāgo arī datubāzes no laika pirms versijām)
+def migrate_base(db):
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        subscription_type TEXT DEFAULT 'free',
+        subscription_expiry DATE
+    )
+    ''')
+
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS searches (
+        search_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        category TEXT,
+        make TEXT,
+        model TEXT,
+        year_from INTEGER,
+        year_to INTEGER,
+        price_from INTEGER,
+        price_to INTEGER,
+        last_checked TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(user_id)
+    )
+    ''')
+
+    db.execute(f"CREATE TABLE IF NOT EXISTS ads {ADS_SCHEMA}")
+
+    # Vecajās datubāzēs ads.ad_id bija vienīgā primārā atslēga
+    pk = [row[1] for row in sorted(db.execute("PRAGMA table_info(ads)"), key=lambda row: row[5]) if row[5]]
+    if pk == ['ad_id']:
+        print("Migrē ads tabulu uz (search_id, ad_id) atslēgu")
+        db.execute(f"CREATE TABLE ads_new {ADS_SCHEMA}")
+        db.execute('''
+        INSERT OR IGNORE INTO ads_new (ad_id, search_id, title, price, url, date_posted, is_new)
+        SELECT ad_id, search_id, title, price, url, date_posted, is_new FROM ads
+        ''')
+        db.execute("DROP TABLE ads")
+        db.execute("ALTER TABLE ads_new RENAME TO ads")
+
+    columns = [row[1] for row in db.execute("PRAGMA table_info(searches)")]
+    if 'lease_owner' not in columns:
+        db.execute("ALTER TABLE searches ADD COLUMN lease_owner TEXT")
+        db.execute("ALTER TABLE searches ADD COLUMN lease_expires REAL")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_searches_lease ON searches(lease_owner)")
+    # Meklēšanas, kuru lapa pastāvīgi neeksistē (404), tiek apturētas līdz lietotājs tās atsāk
+    if 'paused_at' not in columns:
+        db.execute("ALTER TABLE searches ADD COLUMN paused_at TIMESTAMP")
+        db.execute("ALTER TABLE searches ADD COLUMN pause_reason TEXT")
+
+    # Aktīvie scraper procesi - lai katrs zina, cik meklēšanu ir tā taisnīgā daļa
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id TEXT PRIMARY KEY,
+        heartbeat REAL
+    )
+    ''')
+
+    columns = [row[1] for row in db.execute("PRAGMA table_info(ads)")]
+    if 'content_hash' not in columns:
+        db.execute("ALTER TABLE ads ADD COLUMN content_hash INTEGER")
+    if 'first_seen' not in columns:
+        db.execute("ALTER TABLE ads ADD COLUMN first_seen REAL")
+    # Daļējs indekss: tikai vēl nenotīrītie is_new karodziņi
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ads_is_new ON ads(first_seen) WHERE is_new = 1")
+
+    # Sludinājumu izmaiņu vēsture (cenas kritumi, labojumi) - viena rinda uz izmaiņu
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS ad_changes (
+        ad_id TEXT,
+        changed_at TIMESTAMP,
+        old_price INTEGER,
+        new_price INTEGER,
+        old_hash INTEGER,
+        new_hash INTEGER
+    )
+    ''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_ad_changes_ad ON ad_changes(ad_id)")
+
+    # Nenosūtīto paziņojumu rinda - saglabājas pēc restarta
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS notifications (
+        notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        search_id INTEGER,
+        text TEXT,
+        created_at TIMESTAMP,
+        attempts INTEGER DEFAULT 0,
+        next_attempt REAL DEFAULT 0
+    )
+    ''')
+
+    # ads(search_id) nodrošina primārās atslēgas indekss (search_id ir pirmā kolonna)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_searches_user ON searches(user_id)")
+
+# 2: meklēšanu kontrolpunkti - pēc restarta pirmais cikls turpina no tiem (bez atkārtotas salīdzināšanas)
+def migrate_checkpoints(db):
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS search_checkpoints (
+        search_id INTEGER PRIMARY KEY,
+        url TEXT,
+        fingerprint TEXT,         -- lapas nospiedums, ko meklēšana jau apstrādājusi
+        page_fingerprint TEXT,    -- lapas nospiedums, kuram atbilst etag/last_modified
+        etag TEXT,
+        last_modified TEXT,
+        rate REAL,
+        interval REAL,
+        last_run REAL,
+        due REAL
+    )
+    ''')
+
+# 3: ads.price kā INTEGER (bija TEXT; vecā parsera cenas - teksts "12 500 €" vai "Nav norādīta")
+def migrate_ads_price(db):
+    types = {row[1]: row[2] for row in db.execute("PRAGMA table_info(ads)")}
+    if types['price'].upper() != 'INTEGER':
+        db.execute(f"CREATE TABLE ads_new {ADS_SCHEMA}")
+        db.execute('''
+        INSERT INTO ads_new (ad_id, search_id, title, price, url, date_posted, is_new, content_hash, first_seen)
+        SELECT ad_id, search_id, title, price, url, date_posted, is_new, content_hash, first_seen FROM ads
+        ''')
+        db.execute("DROP TABLE ads")
+        db.execute("ALTER TABLE ads_new RENAME TO ads")
+        db.execute("CREATE INDEX IF NOT EXISTS idx_ads_is_new ON ads(first_seen) WHERE is_new = 1")
+    # Skaitļus kā tekstu INTEGER kolonna pārveido pati; pārējo - ar to pašu parse_price kā parseris
+    db.create_function('ss_price', 1, parse_price, deterministic=True)
+    db.execute("UPDATE ads SET price = ss_price(price) WHERE typeof(price) = 'text'")
+
+MIGRATIONS = [migrate_base, migrate_checkpoints, migrate_ads_price]
+
+ADS_ARCHIVE_SCHEMA = '''(
+    ad_id TEXT, search_id INTEGER, title TEXT, price INTEGER, url TEXT, date_posted TEXT,
+    content_hash INTEGER, first_seen REAL, archived_at REAL
+)'''
+
+# Arhīva fails ir atsevišķs un bez versijām - pirms migrācijas 3 izveidotajā price ir TEXT, tā pati pārbūve
+def migrate_archive_price(archive):
+    types = {row[1]: row[2] for row in archive.execute("PRAGMA table_info(ads_archive)")}
+    if types['price'].upper() == 'INTEGER':
+        return
+    archive.create_function('ss_price', 1, parse_price, deterministic=True)
+    archive.execute("BEGIN IMMEDIATE")
+    try:
+        archive.execute(f"CREATE TABLE ads_archive_new {ADS_ARCHIVE_SCHEMA}")
+        archive.execute('''
+        INSERT INTO ads_archive_new
+        SELECT ad_id, search_id, title, CASE WHEN typeof(price) = 'text' THEN ss_price(price) ELSE price END,
+               url, date_posted, content_hash, first_seen, archived_at FROM ads_archive
+        ''')
+        archive.execute("DROP TABLE ads_archive")
+        archive.execute("ALTER TABLE ads_archive_new RENAME TO ads_archive")
+        archive.commit()
+    except Exception:
+        archive.rollback()
+        raise
+
+# Visas trūkstošās migrācijas vienā transakcijā; BEGIN IMMEDIATE - vairāki procesi startā negaida viens otru pusceļā
+def migrate(db):
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+            print(f"DB migrācija {number}: {migration.__name__}")
+            migration(db)
+            db.execute(f"PRAGMA user_version = {number}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+# Katram pavedienam savs lasīšanas savienojums
+db_local = threading.local()
+
+def get_read_conn():
+    db = getattr(db_local, 'conn', None)
+    if db is None:
+        init_app()
+        db = db_local.conn = connect_db()
+    return db
+
+def db_query(sql, params=()):
+    return get_read_conn().execute(sql, params).fetchall()
+
+def db_query_one(sql, params=()):
+    return get_read_conn().execute(sql, params).fetchone()
+
+# Visi ieraksti iet caur vienu rakstītāja pavedienu: darbi ir funkcijas fn(db),
+# katrs izpildās savā transakcijā, rezultāts atgriežas caur Future.
+# Lietotāja komandu darbi (interactive) tiek izpildīti pirms fona darbiem rindā.
+class DBWriter:
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        db = connect_db()
+        while True:
+            _, _, fn, future = self.queue.get()
+            if fn is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                with db:
+                    result = fn(db)
+                future.set_result(result)
+            except Exception as e:
+                print(f"DB write error: {e}")
+                metrics.inc('ss_db_write_errors_total')
+                future.set_exception(e)
+            metrics.observe('ss_db_write_seconds', time.perf_counter() - start)
+        db.close()
+
+    def submit(self, fn, interactive=False):
+        init_app()
+        future = Future()
+        self.queue.put((0 if interactive else 1, next(self.sequence), fn, future))
+        return future
+
+    def execute(self, sql, params=(), interactive=False):
+        return self.submit(lambda db: db.execute(sql, params).rowcount, interactive)
+
+    # Gaida, līdz visi iepriekš iesniegtie darbi ir ierakstīti
+    def flush(self, timeout=None):
+        return self.submit(lambda db: None).result(timeout)
+
+    # Ieraksta visu rindā esošo un aptur pavedienu
+    def stop(self, timeout=None):
+        if self.thread is None:
+            return
+        self.queue.put((2, next(self.sequence), None, None))
+        self.thread.join(timeout)
+
+db_writer = DBWriter()
+metrics.set('ss_db_queue_depth', db_writer.queue.qsize)
+
+# Datubāzi migrē un rakstītāju palaiž pirmajā vajadzības brīdī, nevis importējot moduli
+app_lock = threading.Lock()
+app_ready = False
+shutdown_event = threading.Event()   # SIGTERM/SIGINT - cikli un fona pavedieni beidz darbu
+
+def init_app():
+    global app_ready
+    if app_ready:
+        return
+    with app_lock:
+        if app_ready:
+            return
+        db = connect_db()
+        migrate(db)
+        db.close()
+        db_writer.start()
+        app_ready = True
+
+# Normalizējam marku/modeli, lai "BMW"/"bmw " un "bmw" dotu vienu un to pašu URL ("Rīga" -> "riga")
+def url_slug(text):
+    text = unicodedata.normalize('NFKD', (text or "").strip().lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'\s+', '-', text)
+
+# SS.com scraping function - URL pēc kategorijas ceļa, diviem līmeņiem un tās filtriem
+def build_search_url(category, make, model, year_from=None, year_to=None, price_from=None, price_to=None):
+    definition = get_category(category)
+    base_url = f"{SS_BASE_URL}/lv/{definition['path']}/"
+    make = url_slug(make)
+    model = url_slug(model)
+    url = f"{base_url}{make}/{model}/" if model else f"{base_url}{make}/"
     
-    # Add filters to URL
+    # Add filters to URL (tikai tie, kas kategorijai ir)
     params = []
-    if year_from:
-        params.append(f"year_from={year_from}")
-    if year_to:
-        params.append(f"year_to={year_to}")
-    if price_from:
-        params.append(f"price_from={price_from}")
-    if price_to:
-        params.append(f"price_to={price_to}")
+    for name, values in (('year', (year_from, year_to)), ('price', (price_from, price_to))):
+        if name in definition['filters']:
+            for param, value in zip(definition['filters'][name], values):
+                if value:
+                    params.append(f"{param}={int(value)}")
     
     if params:
         url += "sell/" + "&".join(params) + "/"
     
+    return url
+
+def scrape_ss(category, make, model, year_from=None, year_to=None, price_from=None, price_to=None):
+    return scrape_url(build_search_url(category, make, model, year_from, year_to, price_from, price_to))
+
+# Politeness token bucket - ne vairāk kā `rate` pieprasījumi sekundē uz hostu
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate, capacity):
+        with self.lock:
+            self.rate = rate
+            self.capacity = capacity
+            self.tokens = min(self.tokens, capacity)
+
+# HOST_RATE ir kopējais limits visiem scraper procesiem - katrs process ņem savu daļu (dzīvo worker skaits no nomām)
+host_buckets = {}
+host_buckets_lock = threading.Lock()
+host_share = 1
+
+def host_limits():
+    return HOST_RATE / host_share, max(1, HOST_BURST // host_share)
+
+def get_host_bucket(url):
+    host = urlparse(url).netloc
+    with host_buckets_lock:
+        if host not in host_buckets:
+            host_buckets[host] = TokenBucket(*host_limits())
+        return host_buckets[host]
+
+def set_host_share(workers):
+    global host_share
+    with host_buckets_lock:
+        if max(workers, 1) == host_share:
+            return
+        host_share = max(workers, 1)
+        for bucket in host_buckets.values():
+            bucket.set_rate(*host_limits())
+    metrics.set('ss_host_rate_share', host_share)
+
+# Kļūdu sērijas ierobežotājs: pēc `threshold` kļūdām pēc kārtas atveras (pieprasījumi netiek sūtīti)
+# uz BACKOFF_BASE * 2^n sekundēm (līdz BACKOFF_MAX), pēc tam izlaiž vienu izmēģinājumu (half-open).
+# Retry-After (429) tiek ievērots jau no pirmās kļūdas, un to neatceļ arī vēl ceļā esoša pieprasījuma panākums
+class CircuitBreaker:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.failures = 0
+        self.kind = None
+        self.open_until = 0
+        self.retry_until = 0
+        self.lock = threading.Lock()
+
+    def allow(self, now):
+        with self.lock:
+            if now < self.retry_until:
+                return False
+            if self.failures < self.threshold:
+                return True
+            if now < self.open_until:
+                return False
+            # Half-open: laižam vienu pieprasījumu, pārējie gaida tā rezultātu
+            self.open_until = now + FETCH_TIMEOUT
+            return True
+
+    def is_open(self, now):
+        return (self.failures >= self.threshold and now < self.open_until) or now < self.retry_until
+
+    # Agrākais laiks, kad atkal drīkst sūtīt
+    def until(self):
+        return max(self.open_until, self.retry_until)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.kind = None
+            self.open_until = 0
+
+    def failure(self, now, kind, retry_after=0):
+        with self.lock:
+            self.failures += 1
+            self.kind = kind
+            if retry_after:
+                self.retry_until = max(self.retry_until, now + retry_after)
+            if self.failures >= self.threshold:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - self.threshold))
+                self.open_until = now + delay * random.uniform(0.8, 1.2)
+
+# Hosta kļūdas (SS.com lēns vai nepieejams) atver hostu visiem URL; 404 u.c. - tikai konkrētajam URL
+HOST_ERRORS = {'timeout', 'connection', 'rate_limited', 'http_5xx'}
+
+host_breakers = {}
+url_breakers = {}
+breakers_lock = threading.Lock()
+
+def get_host_breaker(url):
+    host = urlparse(url).netloc
+    with breakers_lock:
+        if host not in host_breakers:
+            host_breakers[host] = CircuitBreaker(HOST_BREAKER_THRESHOLD)
+        return host_breakers[host]
+
+def get_url_breaker(url):
+    with breakers_lock:
+        if url not in url_breakers:
+            url_breakers[url] = CircuitBreaker(1)
+        return url_breakers[url]
+
+def classify_error(e):
+    if isinstance(e, requests.Timeout):
+        return 'timeout'
+    if isinstance(e, requests.ConnectionError):
+        return 'connection'
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        status = e.response.status_code
+        if status in (404, 410):
+            return 'not_found'
+        if status == 429:
+            return 'rate_limited'
+        return 'http_5xx' if status >= 500 else 'http_4xx'
+    return 'other'
+
+# Retry-After ir sekundes vai HTTP datums; nesaprotams vai pagātnē - 0, ne ilgāk par BACKOFF_MAX
+def parse_retry_after(value, now):
+    if not value:
+        return 0
+    value = value.strip()
+    if value.isdigit():
+        seconds = int(value)
+    else:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return 0
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)   # "-0000" - UTC bez zonas
+        seconds = date.timestamp() - now
+    return min(BACKOFF_MAX, max(0, seconds))
+
+# Pieraksta kļūdu hosta un (ja url_level) URL pārtraucējā, atgriež kļūdas klasi
+def record_fetch_error(url, e, url_level=True):
+    kind = classify_error(e)
+    now = time.time()
+    metrics.inc('ss_fetch_errors_total', kind=kind)
+    if kind in HOST_ERRORS:
+        retry_after = 0
+        if kind == 'rate_limited':
+            retry_after = parse_retry_after(e.response.headers.get('Retry-After'), now)
+        get_host_breaker(url).failure(now, kind, retry_after)
+    if url_level:
+        get_url_breaker(url).failure(now, kind)
+    return kind
+
+def record_fetch_success(url):
+    get_host_breaker(url).success()
+    with breakers_lock:
+        url_breakers.pop(url, None)
+
+# Vai drīkst sūtīt pieprasījumu; ja nē - skaita izlaisto pieprasījumu
+def fetch_allowed(url, url_level=True):
+    now = time.time()
+    if not get_host_breaker(url).allow(now):
+        metrics.inc('ss_fetch_skipped_total', reason='host_open')
+        return False
+    breaker = url_breakers.get(url) if url_level else None
+    if breaker is not None and not breaker.allow(now):
+        metrics.inc('ss_fetch_skipped_total', reason='url_backoff')
+        return False
+    return True
+
+# Agrākais laiks, kad URL atkal drīkst ielādēt (plānotājam)
+def fetch_retry_at(url):
+    breakers = (host_breakers.get(urlparse(url).netloc), url_breakers.get(url))
+    return max([breaker.until() for breaker in breakers if breaker is not None], default=0)
+
+# Katram fetch pavedienam sava Session ar keep-alive savienojumu pūlu
+fetch_local = threading.local()
+
+def get_session():
+    session = getattr(fetch_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['User-Agent'] = USER_AGENT
+        fetch_local.session = session
+    return session
+
+fetch_executor = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix='fetch')
+detail_executor = ThreadPoolExecutor(max_workers=DETAIL_CONCURRENCY, thread_name_prefix='detail')
+
+# Atgriež (html, etag, last_modified); html ir None, ja serveris atbild 304 Not Modified
+def fetch_page(url, etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    
+    get_host_bucket(url).acquire()
     try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        ads = []
-        for row in soup.select('tr[id^="tr_"]:not(.head_line)'):
-            # Izlaižam reklāmas rindas
-            if 'bnr' in row.get('id', ''):
-                continue
-                
-            ad_id = row.get('id').replace('tr_', '')
-            
-            # Iegūstam nosaukumu
-            title_elem = row.select_one('a.am')
-            title = title_elem.text.strip() if title_elem else "No title"
-            
-            # Iegūstam visas datu šūnas
-            tds = row.select('td.msga2-o')
-            
-            # Inicializējam datu vārdnīcu
-            ad_data = {
-                'ad_id': ad_id,
-                'title': title,
-                'price': "Nav norādīta",
-                'year': "Nav norādīts",
-                'engine': "Nav norādīts",
-                'transmission': "Nav norādīta",
-                'date': "Nav norādīts",
-                'url': "https://www.ss.com" + title_elem['href'] if title_elem else ""
-            }
-            
-            # Mēģinam identificēt kolonnas pēc to indeksa un satura
-            col_index = 0
-            for td in tds:
-                text = td.text.strip()
-                # Cena parasti ir pēdējā kolonna un satur € simbolu
-                if '€' in text:
-                    ad_data['price'] = text
-                # Gads parasti ir skaitlis no 1900-2099
-                elif text.isdigit() and 1900 <= int(text) <= 2099:
-                    ad_data['year'] = text
-                # Dzinēja tips parasti satur "D" vai "B" vai "benzīns" vai "dīzelis"
-                elif any(fuel in text.lower() for fuel in ['d', 'b', 'benzīns', 'dīzelis', 'benzins', 'dizelis', 'гибрид', 'hybrid']):
-                    ad_data['engine'] = text
-                # Ātrumkārba parasti satur "A" vai "M" vai "automāts" vai "manuāla"
-                elif any(trans in text.lower() for trans in ['a', 'm', 'automāts', 'manuāla', 'automats', 'manuala', 'автомат', 'механика']):
-                    ad_data['transmission'] = text
-                # Datums parasti ir formātā dd.mm.yyyy vai līdzīgā
-                elif '.' in text and len(text) >= 8:
-                    ad_data['date'] = text
-                
-                col_index += 1
-            
-            ads.append(ad_data)
+        with metrics.timer('ss_fetch_seconds'):
+            response = get_session().get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    except Exception:
+        metrics.inc('ss_fetch_total', status='error')
+        raise
+    metrics.inc('ss_fetch_total', status=str(response.status_code))
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    # Bez charset galvenē requests pieņem ISO-8859-1 un sabojā "€" un garumzīmes; SS.com lapas ir UTF-8
+    if 'charset' not in response.headers.get('Content-Type', ''):
+        response.encoding = 'utf-8'
+    return response.text, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+# Sludinājumu rindas (bez reklāmu "tr_bnr_" rindām) - lapas nospiedumam
+AD_ROW_RE = re.compile(r'<tr[^>]*\bid="tr_\d+".*?</tr>', re.S)
+
+# Lēts sludinājumu tabulas nospiedums: mainās, ja parādās/pazūd sludinājums vai mainās tā rinda
+def page_fingerprint(html):
+    digest = hashlib.blake2b(digest_size=8)
+    for row in AD_ROW_RE.findall(html):
+        digest.update(row.encode('utf-8', 'replace'))
+    return digest.hexdigest()
+
+# Katram URL: ETag/Last-Modified, nospiedums un pēdējie parsētie sludinājumi
+page_cache = {}
+
+# Ja visi lapas sludinājumi ir jauni, ejam uz page2.html, page3.html... (jaunākie ir pirmie)
+# līdz pirmajam jau redzētajam sludinājumam, pēdējai lapai vai MAX_PAGES
+def crawl_next_pages(url, html, ads, is_seen):
+    extra_ads = []
+    page_no = 1
+    while (page_no < MAX_PAGES and f'page{page_no + 1}.html"' in html
+           and not any(is_seen(ad.ad_id) for ad in ads)):
+        page_no += 1
+        if not fetch_allowed(url, url_level=False):
+            break
+        try:
+            html, _, _ = fetch_page(f"{url}page{page_no}.html")
+        except Exception as e:
+            kind = record_fetch_error(url, e, url_level=False)
+            log_event('fetch_error', f"Error fetching {url} page {page_no}: {e}",
+                      url=url, page=page_no, kind=kind, error=str(e))
+            break
+        ads = parse_listing(html, layout=listing_section(url))
+        extra_ads += ads
+    return extra_ads
+
+# Atgriež (fingerprint, ads, status) vai None kļūdas gadījumā.
+# status: 'parsed', 'unchanged' (tāds pats nospiedums) vai 'not_modified' (304)
+# is_seen(ad_id) - vai sludinājums šim URL jau ir redzēts; None (jauna meklēšana) - lasām tikai 1. lapu
+def scrape_url(url, is_seen=None):
+    # Hosts vai URL pēc kļūdām vēl "atdziest" - nesūtām pieprasījumu
+    if not fetch_allowed(url):
+        return None
+    
+    entry = page_cache.get(url)
+    try:
+        if entry:
+            html, etag, last_modified = fetch_page(url, entry['etag'], entry['last_modified'])
+        else:
+            html, etag, last_modified = fetch_page(url)
+    except Exception as e:
+        kind = record_fetch_error(url, e)
+        log_event('fetch_error', f"Error fetching {url}: {e}", url=url, page=1, kind=kind, error=str(e))
+        return None
+    record_fetch_success(url)
+    
+    if html is None:
+        return entry['fingerprint'], entry['ads'], 'not_modified'
+    
+    fingerprint = page_fingerprint(html)
+    # Pēc restarta no kontrolpunkta ir tikai nospiedums un ETag, bez sludinājumiem - tad parsējam
+    if entry and entry['fingerprint'] == fingerprint and entry['ads'] is not None:
+        entry['etag'], entry['last_modified'] = etag, last_modified
+        return fingerprint, entry['ads'], 'unchanged'
+    
+    ads = parse_listing(html, layout=listing_section(url))
+    if is_seen:
+        known = {ad.ad_id for ad in ads}
+        for ad in crawl_next_pages(url, html, ads, is_seen):
+            # Sludinājums var pārslīdēt uz nākamo lapu, kamēr mēs lasām
+            if ad.ad_id not in known:
+                known.add(ad.ad_id)
+                ads.append(ad)
+    page_cache[url] = {'etag': etag, 'last_modified': last_modified, 'fingerprint': fingerprint, 'ads': ads}
+    return fingerprint, ads, 'parsed'
+
+# Lejupielādē un parsē visas lapas paralēli, atgriež {url: scrape_url rezultāts}
+def scrape_urls(urls, seen_by_url=None):
+    urls = list(urls)
+    seen_by_url = seen_by_url or {}
+    seen = [seen_by_url.get(url) for url in urls]
+    return dict(zip(urls, fetch_executor.map(scrape_url, urls, seen)))
+
+# Kolonnu virsraksti (SS.com "head_line" rinda) -> lauks un pārveidotājs
+def parse_int(text):
+    digits = re.sub(r'\D', '', text)
+    return int(digits) if digits else None
+
+def parse_year(text):
+    year = parse_int(text)
+    return year if year and 1900 <= year <= 2099 else None
+
+def parse_mileage(text):
+    value = parse_int(text)
+    if value is None:
+        return None
+    # "250 tūkst." / "250 тыс." - tūkstoši kilometru
+    if 'tūkst' in text or 'тыс' in text:
+        value *= 1000
+    return value
+
+def parse_price(text):
+    # "7,500  €" -> 7500; "maiņai", "pērku" u.c. bez cipariem -> None
+    return parse_int(text) if '€' in text else None
+
+def parse_text(text):
+    return text if text and text != '-' else None
+
+# Modeļi, dzinēji, ātrumkārbas atkārtojas tūkstošiem rindu - viena str kopija visām
+def parse_name(text):
+    return sys.intern(text) if text and text != '-' else None
+
+LISTING_COLUMNS = [
+    (('modelis', 'marka', 'модель', 'марка'), 'model', parse_name),
+    (('gads', 'год'), 'year', parse_year),
+    (('tilp', 'объем'), 'engine', parse_name),
+    (('nobrauk', 'пробег'), 'mileage', parse_mileage),
+    (('ātr', 'kārba', 'кпп'), 'transmission', parse_name),
+    (('cena', 'цена'), 'price', parse_price),
+    (('datums', 'дата'), 'date', parse_text),
+]
+
+MOTO_COLUMNS = [
+    (('marka', 'modelis', 'марка', 'модель'), 'model', parse_name),
+    (('gads', 'год'), 'year', parse_year),
+    (('tilp', 'объем'), 'engine', parse_name),
+    (('cena', 'цена'), 'price', parse_price),
+    (('datums', 'дата'), 'date', parse_text),
+]
+
+# "Cena, m2" un "Cena" abas sākas ar "cena" - pēdējā (pilnā cena) pārraksta pirmo
+FLAT_COLUMNS = [
+    (('iela', 'улица'), 'street', parse_text),
+    (('ist', 'комн'), 'rooms', parse_int),
+    (('m2', 'м2'), 'area', parse_int),
+    (('stāvs', 'этаж'), 'floor', parse_text),
+    (('sērija', 'серия'), 'series', parse_name),
+    (('cena', 'цена'), 'price', parse_price),
+    (('datums', 'дата'), 'date', parse_text),
+]
+
+ELECTRONICS_COLUMNS = [
+    (('modelis', 'marka', 'модель', 'марка'), 'model', parse_name),
+    (('stāvoklis', 'состояние'), 'condition', parse_name),
+    (('cena', 'цена'), 'price', parse_price),
+    (('datums', 'дата'), 'date', parse_text),
+]
+
+AD_FIELDS = ('model', 'year', 'engine', 'mileage', 'transmission', 'price', 'date')
+# Citu sadaļu lauki - aizpildīti tikai tad, ja lapā ir attiecīgā kolonna
+EXTRA_FIELDS = ('street', 'rooms', 'area', 'floor', 'series', 'condition')
+# No sludinājuma lapas (enrich_ad)
+DETAIL_FIELDS = ('color', 'body', 'inspection', 'vin')
+
+# Viens saraksta sludinājums. __slots__ - bez dict katrai rindai (page_cache tur visu lapu sludinājumus);
+# cena, gads, nobraukums, istabas un platība ir int, trūkstošs lauks - None
+class Ad:
+    __slots__ = ('ad_id', 'title', 'url') + AD_FIELDS + EXTRA_FIELDS + DETAIL_FIELDS
+    OPTIONAL = AD_FIELDS + EXTRA_FIELDS + DETAIL_FIELDS
+
+    def __init__(self, ad_id, title, url):
+        self.ad_id = ad_id
+        self.title = title
+        self.url = url
+        for field in Ad.OPTIONAL:
+            setattr(self, field, None)
+
+    def copy(self):
+        ad = Ad.__new__(Ad)
+        for field in Ad.__slots__:
+            setattr(ad, field, getattr(self, field))
+        return ad
+
+    def __repr__(self):
+        fields = ', '.join(f"{field}={getattr(self, field)!r}" for field in Ad.__slots__
+                           if getattr(self, field) is not None)
+        return f"Ad({fields})"
+
+# SS.com sadaļas: ceļš, divi meklēšanas līmeņi (make/model kolonnās), URL filtru parametri un saraksta kolonnas.
+# searches.category ir viena no atslēgām; nezināma vērtība (vecās datubāzēs) - 'cars'.
+CATEGORIES = {
+    'cars': {
+        'name': 'Vieglie auto',
+        'path': 'transport/cars',
+        'levels': ('Marka', 'Modelis'),
+        'prompts': ("Lūdzu, ievadiet automašīnas marku (piemēram, Audi, BMW):",
+                    "Lūdzu, ievadiet modeli markai {make} (piemēram, A4, X5):"),
+        'filters': {'year': ('year_from', 'year_to'), 'price': ('price_from', 'price_to')},
+        'columns': LISTING_COLUMNS,
+    },
+    'moto': {
+        'name': 'Motocikli',
+        'path': 'transport/moto-transport/motorcycles',
+        'levels': ('Marka', 'Modelis'),
+        'prompts': ("Lūdzu, ievadiet motocikla marku (piemēram, Honda, Yamaha):",
+                    "Lūdzu, ievadiet modeli markai {make} vai '-' visiem modeļiem:"),
+        'filters': {'year': ('year_from', 'year_to'), 'price': ('price_from', 'price_to')},
+        'columns': MOTO_COLUMNS,
+    },
+    'flats': {
+        'name': 'Dzīvokļi',
+        'path': 'real-estate/flats',
+        'levels': ('Pilsēta/rajons', 'Apkaime'),
+        'prompts': ("Lūdzu, ievadiet pilsētu vai rajonu (piemēram, Riga, Jurmala):",
+                    "Lūdzu, ievadiet apkaimi (piemēram, centre, teika) vai '-' visai pilsētai:"),
+        'filters': {'price': ('price_from', 'price_to')},
+        'columns': FLAT_COLUMNS,
+    },
+    'electronics': {
+        'name': 'Elektronika',
+        'path': 'electronics',
+        'levels': ('Sadaļa', 'Apakšsadaļa'),
+        'prompts': ("Lūdzu, ievadiet sadaļu (piemēram, phones, computers):",
+                    "Lūdzu, ievadiet apakšsadaļu (piemēram, mobile-phones, notebooks) vai '-' visai sadaļai:"),
+        'filters': {'price': ('price_from', 'price_to')},
+        'columns': ELECTRONICS_COLUMNS,
+    },
+}
+
+def get_category(category):
+    return CATEGORIES.get(category) or CATEGORIES['cars']
+
+LISTING_SUFFIX_RE = re.compile(r'(sell/.*|page\d+\.html)$')
+
+# URL -> (kategorija, sadaļas ceļš bez filtriem un lapas numura) - atslēga izkārtojuma kešam un tirgus cenām
+@functools.lru_cache(maxsize=65536)
+def listing_section(url):
+    path = LISTING_SUFFIX_RE.sub('', urlparse(url).path)
+    for key, category in CATEGORIES.items():
+        if path.startswith(f"/lv/{category['path']}/"):
+            return key, path
+    return 'cars', path
+
+# No virsrakstu tekstiem un colspan izveido [(td indekss, lauks, pārveidotājs)]
+def build_column_map(header_cells, columns=LISTING_COLUMNS):
+    column_map = []
+    index = 0
+    for label, colspan in header_cells:
+        label = label.strip().lower()
+        for prefixes, field, convert in columns:
+            if label.startswith(prefixes):
+                column_map.append((index, field, convert))
+                break
+        index += colspan
+    return column_map
+
+# Noteiktais kolonnu izkārtojums katrai (kategorija, sadaļa): kamēr virsraksti nemainās, karte netiek
+# veidota no jauna; lapai bez virsrakstu rindas (piem., tukšs saraksts) der iepriekšējā karte
+layout_cache = {}
+
+def get_column_map(header_cells, layout=None):
+    category = layout[0] if layout else 'cars'
+    columns = get_category(category)['columns']
+    if layout is None:
+        return build_column_map(header_cells, columns)
+    header_key = tuple(header_cells)
+    cached = layout_cache.get(layout)
+    if cached is not None and (cached[0] == header_key or not header_cells):
+        return cached[1]
+    column_map = build_column_map(header_cells, columns)
+    if not header_cells:
+        return column_map   # lapa bez virsrakstu rindas (tukšs saraksts) - izkārtojums vēl nav zināms, nekešojam
+    if cached is not None:
+        log_event('layout_changed', f"Mainījies kolonnu izkārtojums: {layout[1]}",
+                  category=category, section=layout[1], columns=[label.strip() for label, _ in header_cells])
+    metrics.inc('ss_layouts_detected_total', category=category)
+    layout_cache[layout] = (header_key, column_map)
+    return column_map
+
+def new_ad(ad_id, title, href):
+    return Ad(ad_id, title, SS_BASE_URL + href if href else "")
+
+def parse_listing_lxml(html, layout=None):
+    doc = lxml.html.fromstring(html)
+    header = [(td.text_content(), int(td.get('colspan') or 1))
+              for td in doc.xpath('//tr[@id="head_line"]/td')]
+    column_map = get_column_map(header, layout)
+    
+    ads = []
+    for row in doc.xpath('//tr[starts-with(@id, "tr_") and not(starts-with(@id, "tr_bnr"))]'):
+        links = row.xpath('.//a[contains(concat(" ", @class, " "), " am ")]')
+        title_elem = links[0] if links else None
+        ad_data = new_ad(row.get('id')[3:],
+                         title_elem.text_content().strip() if title_elem is not None else "",
+                         title_elem.get('href') if title_elem is not None else None)
         
-        return ads
+        tds = row.findall('td')
+        for index, field, convert in column_map:
+            if index < len(tds):
+                setattr(ad_data, field, convert(tds[index].text_content().strip()))
+        ads.append(ad_data)
+    return ads
+
+def parse_listing_bs4(html, layout=None):
+    soup = BeautifulSoup(html, 'html.parser')
+    header_row = soup.find('tr', id='head_line')
+    header = [(td.get_text(), int(td.get('colspan') or 1))
+              for td in header_row.find_all('td', recursive=False)] if header_row else []
+    column_map = get_column_map(header, layout)
     
+    ads = []
+    for row in soup.find_all('tr', id=re.compile(r'^tr_\d')):
+        title_elem = row.find('a', class_='am')
+        ad_data = new_ad(row['id'][3:],
+                         title_elem.get_text().strip() if title_elem else "",
+                         title_elem.get('href') if title_elem else None)
+        
+        tds = row.find_all('td', recursive=False)
+        for index, field, convert in column_map:
+            if index < len(tds):
+                setattr(ad_data, field, convert(tds[index].get_text().strip()))
+        ads.append(ad_data)
+    return ads
+
+PARSER_BACKENDS = {'bs4': parse_listing_bs4}
+if lxml is not None:
+    PARSER_BACKENDS['lxml'] = parse_listing_lxml
+
+def get_parser(backend=PARSER_BACKEND):
+    if backend == 'auto':
+        backend = 'lxml' if 'lxml' in PARSER_BACKENDS else 'bs4'
+    return PARSER_BACKENDS[backend]
+
+def parse_listing(html, backend=PARSER_BACKEND, layout=None):
+    start = time.perf_counter()
+    try:
+        ads = get_parser(backend)(html, layout)
     except Exception as e:
-        print(f"Error scraping SS.com: {e}")
+        print(f"Error parsing SS.com page: {e}")
+        metrics.inc('ss_parse_errors_total')
         return []
+    metrics.observe('ss_parse_seconds', time.perf_counter() - start)
+    metrics.inc('ss_parsed_rows_total', len(ads))
+    return ads
 
-# Check for new ads periodically
-def check_new_ads():
-    while True:
-        cursor.execute("SELECT * FROM searches")
-        searches = cursor.fetchall()
+# Sludinājuma lapas parametru tabula ("ads_opt_name" -> "ads_opt") -> lauks un pārveidotājs
+DETAIL_COLUMNS = [
+    (('izlaiduma gads', 'год выпуска'), 'year', parse_year),
+    (('motors', 'dzinējs', 'двигатель'), 'engine', parse_text),
+    (('ātr', 'коробка'), 'transmission', parse_text),
+    (('nobraukums', 'пробег'), 'mileage', parse_mileage),
+    (('krāsa', 'цвет'), 'color', parse_text),
+    (('virsbūves tips', 'тип кузова'), 'body', parse_text),
+    (('tehniskā apskate', 'техосмотр'), 'inspection', parse_text),
+    (('vin',), 'vin', parse_text),
+]
+
+def detail_field(label, value, details):
+    label = label.strip().lower()
+    for prefixes, field, convert in DETAIL_COLUMNS:
+        if label.startswith(prefixes):
+            details[field] = convert(value.strip())
+            break
+
+def parse_detail_lxml(html):
+    doc = lxml.html.fromstring(html)
+    details = {}
+    for name_td in doc.xpath('//td[contains(concat(" ", @class, " "), " ads_opt_name ")]'):
+        value_td = name_td.getnext()
+        if value_td is not None:
+            detail_field(name_td.text_content(), value_td.text_content(), details)
+    return details
+
+def parse_detail_bs4(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    details = {}
+    for name_td in soup.find_all('td', class_='ads_opt_name'):
+        value_td = name_td.find_next_sibling('td')
+        if value_td is not None:
+            detail_field(name_td.get_text(), value_td.get_text(), details)
+    return details
+
+DETAIL_PARSERS = {'bs4': parse_detail_bs4}
+if lxml is not None:
+    DETAIL_PARSERS['lxml'] = parse_detail_lxml
+
+def parse_detail(html, backend=PARSER_BACKEND):
+    if backend == 'auto':
+        backend = 'lxml' if 'lxml' in DETAIL_PARSERS else 'bs4'
+    try:
+        return DETAIL_PARSERS[backend](html)
+    except Exception as e:
+        print(f"Error parsing SS.com ad page: {e}")
+        return {}
+
+# Sludinājumu lapu detaļas: url -> (derīgs līdz, lauki); LRU ar TTL, kopīgs visām meklēšanām
+class DetailCache:
+    def __init__(self, ttl, capacity):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[url]
+                return None
+            self.entries.move_to_end(url)
+            return entry[1]
+
+    def put(self, url, details):
+        with self.lock:
+            self.entries[url] = (time.time() + self.ttl, details)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+detail_cache = DetailCache(DETAIL_TTL, DETAIL_CACHE_SIZE)
+
+# Vienas sludinājuma lapas detaļas: no keša (tās var būt ielādētas pēc tam, kad cikls tās plānoja) vai
+# ielādē; ja to pašu lapu jau ielādē cits pavediens, gaida tā rezultātu, nevis ielādē otrreiz
+detail_inflight = {}
+detail_inflight_lock = threading.Lock()
+
+def fetch_detail(url):
+    cached = detail_cache.get(url)
+    if cached is not None:
+        metrics.inc('ss_details_total', result='cached')
+        return cached
+    with detail_inflight_lock:
+        future = detail_inflight.get(url)
+        loading = future is None
+        if loading:
+            future = detail_inflight[url] = Future()
+    if not loading:
+        return future.result()
+    details = None
+    try:
+        details = load_detail(url)
+    finally:
+        with detail_inflight_lock:
+            del detail_inflight[url]
+        future.set_result(details)
+    return details
+
+def load_detail(url):
+    if not fetch_allowed(url, url_level=False):
+        return None
+    try:
+        html, _, _ = fetch_page(url)
+    except Exception as e:
+        kind = record_fetch_error(url, e, url_level=False)
+        log_event('fetch_error', f"Error fetching {url}: {e}", url=url, page='detail', kind=kind, error=str(e))
+        metrics.inc('ss_details_total', result='error')
+        return None
+    metrics.inc('ss_details_total', result='fetched')
+    details = parse_detail(html)
+    detail_cache.put(url, details)
+    return details
+
+# Jauno sludinājumu lapas: ({url: detaļas no keša}, ielādējamie URL). Kešā esošās netiek ielādētas
+# atkārtoti, ne vairāk kā DETAIL_MAX_PER_CYCLE lapas ciklā
+def plan_details(urls):
+    details = {}
+    missing = []
+    for url in urls:
+        cached = detail_cache.get(url)
+        if cached is None:
+            missing.append(url)
+        else:
+            details[url] = cached
+    metrics.inc('ss_details_total', len(details), result='cached')
+    metrics.inc('ss_details_total', max(0, len(missing) - DETAIL_MAX_PER_CYCLE), result='skipped')
+    return details, missing[:DETAIL_MAX_PER_CYCLE]
+
+# {url: detaļas}, DETAIL_CONCURRENCY lapas paralēli
+def fetch_details(urls):
+    details = {}
+    for url, fetched in zip(urls, detail_executor.map(fetch_detail, urls)):
+        if fetched is not None:
+            details[url] = fetched
+    return details
+
+# Detaļas papildina saraksta rindu: aizpilda trūkstošos laukus un pievieno jaunos (krāsa, VIN...)
+def enrich_ad(ad, details):
+    if not details:
+        return ad
+    enriched = ad.copy()
+    for field, value in details.items():
+        if value is not None and getattr(enriched, field) is None:
+            setattr(enriched, field, value)
+    return enriched
+
+# Detaļu posms ārpus cikla: paziņojumi, kuru lapa nav kešā, ir jau ierakstīti (aizturēti), šeit ielādējam
+# to sludinājumu lapas, atjaunojam tekstu un atļaujam sūtīt uzreiz. Ja tas nenotiek (kļūda, restarts),
+# pēc DETAIL_WAIT paziņojums aiziet ar saraksta datiem
+class DetailEnricher:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, items):
+        if not items:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='enricher', daemon=True)
+                self.thread.start()
+        self.queue.put(items)
+
+    def run(self):
+        while True:
+            items = self.queue.get()
+            try:
+                self.enrich(items)
+            except Exception as e:
+                print(f"Detail enricher error: {e}")
+            finally:
+                self.queue.task_done()
+
+    # (notification_id, ad, market) - jauno sludinājumu lapas vienreiz katram URL
+    def enrich(self, items):
+        start = time.perf_counter()
+        details = fetch_details(dict.fromkeys(ad.url for _, ad, _ in items))
+        metrics.observe('ss_enrich_seconds', time.perf_counter() - start)
+        # Jau nosūtītie (DETAIL_WAIT beidzies) vairs nav tabulā - UPDATE tos neatrod
+        db_writer.submit(lambda db: db.executemany(
+            "UPDATE notifications SET text = ?, next_attempt = 0 WHERE notification_id = ? AND attempts = 0",
+            [(format_ad_message(enrich_ad(ad, details.get(ad.url)), market), notification_id)
+             for notification_id, ad, market in items])).add_done_callback(lambda _: dispatcher.wake())
+
+    # Gaida, līdz visi iesniegtie paziņojumi ir papildināti (benchmark, testi)
+    def flush(self):
+        self.queue.join()
+
+detail_enricher = DetailEnricher()
+
+def format_number(value):
+    return f"{value:,}".replace(',', ' ')
+
+def format_ad_message(ad, market=None):
+    emoji = "🟢"  # Zaļš aplis jauniem sludinājumiem
+    
+    # Veidojam ziņu tikai ar tiem datiem, kas ir pieejami
+    message = f"{emoji} Jauns sludinājums!\n\n{ad.title}"
+    
+    if ad.model:
+        message += f"\nModelis: {ad.model}"
+    
+    if ad.year:
+        message += f"\nGads: {ad.year}"
+    
+    if ad.engine:
+        message += f"\nDzinējs: {ad.engine}"
+    
+    if ad.mileage:
+        message += f"\nNobraukums: {format_number(ad.mileage)} km"
+    
+    if ad.transmission:
+        message += f"\nĀtrumkārba: {ad.transmission}"
+    
+    if ad.street:
+        message += f"\nIela: {ad.street}"
+    
+    if ad.rooms:
+        message += f"\nIstabas: {ad.rooms}"
+    
+    if ad.area:
+        message += f"\nPlatība: {ad.area} m²"
+    
+    if ad.floor:
+        message += f"\nStāvs: {ad.floor}"
+    
+    if ad.series:
+        message += f"\nSērija: {ad.series}"
+    
+    if ad.condition:
+        message += f"\nStāvoklis: {ad.condition}"
+    
+    if ad.body:
+        message += f"\nVirsbūve: {ad.body}"
+    
+    if ad.color:
+        message += f"\nKrāsa: {ad.color}"
+    
+    if ad.inspection:
+        message += f"\nTehniskā apskate: {ad.inspection}"
+    
+    if ad.vin:
+        message += f"\nVIN: {ad.vin}"
+    
+    if ad.price:
+        message += f"\nCena: {format_number(ad.price)} €"
+    
+    if market:
+        discount, median, count = market
+        message += f"\n📉 {discount:.0%} zem tirgus cenas (mediāna {format_number(round(median))} €, {count} sludinājumi)"
+    
+    message += f"\n\n{ad.url}"
+    return message
+
+def search_url(search):
+    search_id, user_id, category, make, model, year_from, year_to, price_from, price_to, last_checked = search
+    if BROAD_CRAWL:
+        return build_search_url(category, make, model)
+    return build_search_url(category, make, model, year_from, year_to, price_from, price_to)
+
+# Sagrupē meklēšanas pēc URL, uz kuru tās atrisinās, lai katru SS.com lapu
+# lejupielādētu un parsētu tikai vienreiz ciklā
+def plan_fetches(searches):
+    plan = {}
+    for search in searches:
+        plan.setdefault(search_url(search), []).append(search)
+    return plan
+
+# Centrēts intervālu koks: stab(x) atgriež atslēgas visiem intervāliem [lo, hi], kas satur x.
+# None robeža nozīmē "bez ierobežojuma".
+class IntervalIndex:
+    def __init__(self, intervals):
+        intervals = [(-math.inf if lo is None else lo, math.inf if hi is None else hi, key)
+                     for lo, hi, key in intervals]
+        # Apgriezts diapazons (piem., "2020 2010") neder nevienai vērtībai
+        intervals = [iv for iv in intervals if iv[0] <= iv[1]]
+        self.unbounded = [key for lo, hi, key in intervals if lo == -math.inf and hi == math.inf]
+        self.root = self._build(intervals)
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(p for lo, hi, _ in intervals for p in (lo, hi) if math.isfinite(p))
+        center = points[len(points) // 2] if points else 0
+        left = [iv for iv in intervals if iv[1] < center]
+        right = [iv for iv in intervals if iv[0] > center]
+        middle = [iv for iv in intervals if iv[0] <= center <= iv[1]]
+        return (center,
+                sorted(middle, key=lambda iv: iv[0]),
+                sorted(middle, key=lambda iv: iv[1], reverse=True),
+                self._build(left), self._build(right))
+
+    def stab(self, x):
+        # Sludinājumam bez vērtības (piem., cena "maiņai") der tikai meklēšanas bez šī filtra
+        if x is None:
+            return list(self.unbounded)
+        result = []
+        node = self.root
+        while node:
+            center, by_lo, by_hi, left, right = node
+            if x < center:
+                for lo, hi, key in by_lo:
+                    if lo > x:
+                        break
+                    result.append(key)
+                node = left
+            elif x > center:
+                for lo, hi, key in by_hi:
+                    if hi < x:
+                        break
+                    result.append(key)
+                node = right
+            else:
+                result.extend(key for lo, hi, key in by_lo)
+                break
+        return result
+
+# Visu viena URL meklēšanu gada/cenas filtri - lai nefiltrētas lapas sludinājumus sadalītu meklēšanām
+class SearchMatcher:
+    def __init__(self, searches):
+        self.year_index = IntervalIndex([(search[5], search[6], search[0]) for search in searches])
+        self.price_index = IntervalIndex([(search[7], search[8], search[0]) for search in searches])
+
+    # Atgriež {search_id: [ads]}
+    def match(self, ads):
+        matched = {}
+        for ad in ads:
+            years = self.year_index.stab(ad.year)
+            if not years:
+                continue
+            for search_id in set(years).intersection(self.price_index.stab(ad.price)):
+                matched.setdefault(search_id, []).append(ad)
+        return matched
+
+matcher_cache = {}
+
+def get_matcher(url, searches):
+    key = tuple(sorted(tuple(search[:1] + search[5:9]) for search in searches))
+    cached = matcher_cache.get(url)
+    if cached is None or cached[0] != key:
+        cached = matcher_cache[url] = (key, SearchMatcher(searches))
+    return cached[1]
+
+# Vienas sadaļas (marka/modelis) pašreizējo sludinājumu cenas un gadi kolonnās - mediāna un
+# "zem tirgus cenas" tiek rēķinātas ar NumPy vektoriem (ja instalēts) vai array masīviem, bez rindu dict
+class MarketSnapshot:
+    def __init__(self, ads):
+        prices = array('q')
+        years = array('q')
+        for ad in ads:
+            if ad.price:
+                prices.append(ad.price)
+                years.append(ad.year or 0)
+        if numpy is not None:
+            prices = numpy.frombuffer(prices, dtype=numpy.int64)
+            years = numpy.frombuffer(years, dtype=numpy.int64)
+        self.prices = prices
+        self.years = years
+        self.medians = {}   # gads (None - visa sadaļa) -> (mediāna, skaits)
+
+    def median(self, year=None):
+        if year not in self.medians:
+            if numpy is not None:
+                prices = self.prices if year is None else self.prices[numpy.abs(self.years - year) <= MARKET_YEAR_SPAN]
+                median = float(numpy.median(prices)) if len(prices) else None
+            else:
+                prices = self.prices if year is None else [
+                    price for price, ad_year in zip(self.prices, self.years) if abs(ad_year - year) <= MARKET_YEAR_SPAN]
+                median = statistics.median(prices) if len(prices) else None
+            self.medians[year] = (median, len(prices))
+        return self.medians[year]
+
+    # (atlaide, mediāna, skaits), ja sludinājums ir vismaz MARKET_DISCOUNT lētāks par tirgu, citādi None.
+    # Auto/moto salīdzina ar tā paša gada ±1 sludinājumiem, sadaļām bez gada (dzīvokļi) - ar visiem
+    def below_market(self, ad):
+        if not ad.price:
+            return None
+        median, count = self.median(ad.year)
+        if median is None or count < MARKET_MIN_SAMPLES:
+            return None
+        discount = 1 - ad.price / median
+        return (discount, median, count) if discount >= MARKET_DISCOUNT else None
+
+# Momentuzņēmumi dotajām sadaļām no to nefiltrētajām lapām, katrs sludinājums vienreiz. Lapas ar
+# cenas/gada filtru (sell/...) neder - to mediāna būtu filtra, nevis tirgus; ja datu nav, atzīmes nebūs
+def market_snapshots(sections):
+    ads_by_section = {section: {} for section in sections}
+    for url, entry in list(page_cache.items()):
+        if '/sell/' in url:
+            continue
+        section_ads = ads_by_section.get(listing_section(url))
+        if section_ads is not None and entry['ads']:
+            for ad in entry['ads']:
+                section_ads[ad.ad_id] = ad
+    return {section: MarketSnapshot(ads.values()) for section, ads in ads_by_section.items()}
+
+# Kuras lapas versiju (nospiedumu) katra meklēšana jau ir apstrādājusi
+search_fingerprints = {}
+# Pēdējais kontrolpunktos ierakstītais (url, nospiedums, lapas nospiedums, ETag, Last-Modified) katrai meklēšanai
+saved_checkpoints = {}
+
+# Kontrolpunkta rinda tikai, ja tā atšķiras no pēdējās ierakstītās - nemainīgai lapai nekas netiek rakstīts
+def checkpoint_row(search_id, url, fingerprint, validators):
+    state = (url, fingerprint) + validators
+    if saved_checkpoints.get(search_id) == state:
+        return None
+    saved_checkpoints[search_id] = state
+    return (search_id,) + state
+
+SEARCH_COLUMNS = ("s.search_id, s.user_id, s.category, s.make, s.model, "
+                  "s.year_from, s.year_to, s.price_from, s.price_to, s.last_checked")
+
+# Meklēšanu plānotājs: kaudze (heap) pēc nākamā pārbaudes laika.
+# Intervāls katrai meklēšanai pielāgojas jauno sludinājumu plūsmai abonementa robežās.
+class PollScheduler:
+    def __init__(self):
+        self.heap = []
+        self.state = {}
+        self.urls = set()
+        self.started = False
+        self.lags = []
+        self.dirty = set()     # meklēšanas, kuru stāvoklis mainījies kopš pēdējā kontrolpunkta
+
+    # Atgriež (pievienotās, izņemtās) meklēšanas
+    def sync(self, rows):
+        now = time.time()
+        seen = set()
+        added = []
+        for row in rows:
+            search, tier = tuple(row[:-1]), row[-1] if row[-1] in POLL_INTERVALS else 'free'
+            search_id = search[0]
+            seen.add(search_id)
+            state = self.state.get(search_id)
+            if state is None:
+                # Startā izkliedējam pirmās pārbaudes, lai visas nenotiek vienā brīdī
+                delay = random.uniform(0, POLL_INTERVALS[tier][0]) if not self.started else 0
+                state = self.state[search_id] = {'rate': None, 'interval': POLL_INTERVALS[tier][1],
+                                                 'last_run': None, 'due': now + delay}
+                heapq.heappush(self.heap, (state['due'], search_id))
+                added.append(search_id)
+            state['search'] = search
+            state['tier'] = tier
+            state['url'] = search_url(search)
+        removed = [search_id for search_id in self.state if search_id not in seen]
+        for search_id in removed:
+            del self.state[search_id]
+        self.urls = {state['url'] for state in self.state.values()}
+        self.started = True
+        return added, removed
+
+    # Meklēšanas, kuru sagatavošana neizdevās, izņem - nākamā sync tās pievienos no jauna
+    def drop(self, search_ids):
+        for search_id in search_ids:
+            self.state.pop(search_id, None)
+        self.urls = {state['url'] for state in self.state.values()}
+
+    def next_due(self):
+        while self.heap and self._stale(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else time.time() + SEARCH_REFRESH
+
+    def _stale(self, entry):
+        state = self.state.get(entry[1])
+        return state is None or state['due'] != entry[0]
+
+    # Izņem visas meklēšanas, kurām pienācis laiks, un tās, kas skatās to pašu URL
+    # un būtu kārtā drīz (pusintervāla laikā) - tā lapa tiek ielādēta vienreiz
+    def pop_due(self, now):
+        due_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            due, search_id = heapq.heappop(self.heap)
+            if not self._stale((due, search_id)):
+                due_ids.append(search_id)
+                self.lags.append(now - due)
+        if not due_ids:
+            return []
         
+        due_urls = {self.state[search_id]['url'] for search_id in due_ids}
+        taken = set(due_ids)
+        for search_id, state in self.state.items():
+            # Broad-crawl režīmā lapa tāpat ir ielādēta - visām tās meklēšanām tas ir par brīvu
+            if (search_id not in taken and state['url'] in due_urls
+                    and (BROAD_CRAWL or state['due'] - now <= state['interval'] / 2)):
+                due_ids.append(search_id)
+                taken.add(search_id)
+        for search_id in due_ids:
+            self.state[search_id]['due'] = None
+        return [self.state[search_id]['search'] for search_id in due_ids]
+
+    # new_counts: {search_id: jaunu sludinājumu skaits}; kļūdas gadījumā meklēšanas tajā nav
+    def reschedule(self, searches, new_counts, now):
         for search in searches:
+            state = self.state.get(search[0])
+            if state is None:
+                continue  # meklēšana dzēsta cikla laikā
+            low, base, high = POLL_INTERVALS[state['tier']]
+            if search[0] in new_counts and state['last_run'] is not None:
+                # Jauno sludinājumu plūsma (EWMA, sludinājumi sekundē)
+                rate = new_counts[search[0]] / max(now - state['last_run'], 1)
+                state['rate'] = rate if state['rate'] is None else (
+                    POLL_RATE_ALPHA * rate + (1 - POLL_RATE_ALPHA) * state['rate'])
+                # Intervāls, pie kura vidēji sagaidāms POLL_TARGET_NEW jauns sludinājums
+                interval = POLL_TARGET_NEW / state['rate'] if state['rate'] > 0 else high
+                state['interval'] = min(high, max(low, interval))
+            elif search[0] not in new_counts:
+                state['interval'] = base
+            state['last_run'] = now
+            jitter = random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+            # Pēc kļūdām URL/hosts atdziest - agrāk par to pārbaudīt nav jēgas
+            state['due'] = max(now + state['interval'] * jitter, fetch_retry_at(state['url']))
+            heapq.heappush(self.heap, (state['due'], search[0]))
+            self.dirty.add(search[0])
+        
+        if self.lags:
+            metrics.set('ss_cycle_lag_seconds', max(self.lags))
+            log_event('lag', f"Kavēšanās: vid. {sum(self.lags) / len(self.lags):.1f}s, maks. {max(self.lags):.1f}s",
+                      avg=round(sum(self.lags) / len(self.lags), 3), max=round(max(self.lags), 3))
+            self.lags = []
+
+    # Stāvoklis no kontrolpunkta (meklēšana tikko pievienota ar sync)
+    def restore(self, search_id, rate, interval, last_run, due):
+        state = self.state[search_id]
+        low, _, high = POLL_INTERVALS[state['tier']]
+        state['rate'] = rate
+        state['last_run'] = last_run
+        if interval:
+            state['interval'] = min(high, max(low, interval))   # abonements var būt mainījies
+        if due is not None:
+            state['due'] = min(due, time.time() + state['interval'])
+            heapq.heappush(self.heap, (state['due'], search_id))
+
+    # Kontrolpunktu rindas (rate, interval, last_run, due, search_id) mainītajām vai visām meklēšanām
+    def checkpoint_rows(self, everything=False):
+        search_ids = list(self.state) if everything else [i for i in self.dirty if i in self.state]
+        self.dirty = set()
+        return [(self.state[i]['rate'], self.state[i]['interval'], self.state[i]['last_run'], self.state[i]['due'], i)
+                for i in search_ids]
+
+scheduler = PollScheduler()
+metrics.set('ss_searches_scheduled', lambda: len(scheduler.state))
+def count_open_breakers():
+    now = time.time()
+    with breakers_lock:
+        return sum(breaker.is_open(now) for breaker in list(host_breakers.values()) + list(url_breakers.values()))
+
+metrics.set('ss_breakers_open', count_open_breakers)
+
+# Bloom filtrs sludinājumiem, kas izspiesti no SeenIndex atmiņas.
+# Divas paaudzes: kad pašreizējā pilna, vecākā tiek izmesta.
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.hashes = max(1, round(-math.log2(error_rate)))
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.current = bytearray((self.size + 7) // 8)
+        self.previous = None
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        if self.count >= self.capacity:
+            self.previous, self.current, self.count = self.current, bytearray(len(self.current)), 0
+        for pos in self._positions(key):
+            self.current[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        for bits in (self.current, self.previous):
+            if bits is not None and all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions):
+                return True
+        return False
+
+NOT_SEEN = object()
+BLOOM_SEEN = object()   # redzēts, bet izspiests no atmiņas - satura hešs nav zināms
+
+# Atmiņā turēts redzēto sludinājumu indekss: search_id -> LRU no ad_id -> satura hešs.
+# Ielādējas no SQLite vienreiz startā, tālāk tiek papildināts cikla laikā.
+class SeenIndex:
+    def __init__(self, per_search=SEEN_PER_SEARCH, bloom_capacity=SEEN_BLOOM_CAPACITY):
+        self.per_search = per_search
+        self.searches = {}
+        self.bloom = BloomFilter(bloom_capacity) if bloom_capacity else None
+        self.lock = threading.Lock()
+
+    # Ielādē no DB meklēšanas, kuras šis process tikko paņēmis (startā - visas savas)
+    def load(self, db, search_ids):
+        search_ids = list(search_ids)
+        for i in range(0, len(search_ids), 500):
+            chunk = search_ids[i:i + 500]
+            rows = db.execute(f"""
+            SELECT search_id, ad_id, content_hash FROM ads
+            WHERE search_id IN ({','.join('?' * len(chunk))}) ORDER BY rowid
+            """, chunk).fetchall()
+            with self.lock:
+                for search_id in chunk:
+                    self.searches[search_id] = OrderedDict()
+                for search_id, ad_id, content_hash in rows:
+                    self.searches[search_id][ad_id] = content_hash
+                for search_id in chunk:
+                    self._evict(search_id)
+
+    # Atgriež saglabāto satura hešu (None - vecs ieraksts bez heša), BLOOM_SEEN vai NOT_SEEN
+    def lookup(self, search_id, ad_id):
+        ads = self.searches.get(search_id)
+        if ads is not None and ad_id in ads:
+            return ads[ad_id]
+        if self.bloom is not None and f"{search_id}:{ad_id}" in self.bloom:
+            return BLOOM_SEEN
+        return NOT_SEEN
+
+    def is_seen(self, search_id, ad_id):
+        return self.lookup(search_id, ad_id) is not NOT_SEEN
+
+    def has_ads(self, search_id):
+        return bool(self.searches.get(search_id))
+
+    # Atzīmē sludinājumus kā redzētus (un svaigākos LRU secībā); hashes: {ad_id: satura hešs}
+    def mark_seen(self, search_id, hashes):
+        with self.lock:
+            ads = self.searches.setdefault(search_id, OrderedDict())
+            for ad_id, content_hash in hashes.items():
+                ads[ad_id] = content_hash
+                ads.move_to_end(ad_id)
+            self._evict(search_id)
+
+    def _evict(self, search_id):
+        ads = self.searches[search_id]
+        while len(ads) > self.per_search:
+            ad_id, _ = ads.popitem(last=False)
+            if self.bloom is not None:
+                self.bloom.add(f"{search_id}:{ad_id}")
+
+    def forget(self, search_id):
+        with self.lock:
+            self.searches.pop(search_id, None)
+
+    # Atsauc mark_seen, ja cikla ieraksts neizdevās: previous = {ad_id: iepriekšējais hešs vai NOT_SEEN}
+    def restore(self, search_id, previous):
+        with self.lock:
+            ads = self.searches.get(search_id)
+            if ads is None:
+                return
+            for ad_id, content_hash in previous.items():
+                if content_hash is NOT_SEEN:
+                    ads.pop(ad_id, None)
+                else:
+                    ads[ad_id] = content_hash
+
+seen_index = SeenIndex()
+
+# Lauki, no kuriem rēķina sludinājuma satura hešu
+HASH_FIELDS = ('title', 'url') + AD_FIELDS
+
+# Kompakts satura hešs (signed 64-bit, der SQLite INTEGER kolonnai)
+def content_hash(ad):
+    values = [getattr(ad, field) for field in HASH_FIELDS]
+    data = '\x1f'.join('' if value is None else str(value) for value in values)
+    # Citu sadaļu lauki tikai, ja tie ir - auto sludinājumu hešs paliek tāds pats
+    for field in EXTRA_FIELDS:
+        value = getattr(ad, field)
+        if value is not None:
+            data += f'\x1f{field}={value}'
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), 'little', signed=True)
+
+def write_cycle(db, new_rows, changed_rows, change_log, notifications, checkpoints):
+    # Rakstām tikai meklēšanām, kas joprojām ir mūsu nomā: meklēšana var tikt dzēsta vai
+    # nodota citam procesam, kamēr cikls strādā - tad tas process to apstrādās, bez dubultiem paziņojumiem
+    owned = {row[0] for row in db.execute("SELECT search_id FROM searches WHERE lease_owner = ?", (WORKER_ID,))}
+    new_rows = [row for row in new_rows if row[1] in owned]
+    changed_rows = [row for row in changed_rows if row[5] in owned]
+    change_log = [row for row in change_log if row[3] in owned]
+    checkpoints = [row for row in checkpoints if row[0] in owned]
+    
+    db.executemany('''
+    INSERT OR REPLACE INTO ads (ad_id, search_id, title, price, url, date_posted, is_new, content_hash, first_seen)
+    VALUES (?, ?, ?, ?, ?, ?, 1, ?, strftime('%s', 'now'))
+    ''', new_rows)
+    # Vēsturē ierakstām veco cenu/hešu no DB pirms atjaunošanas. To pašu izmaiņu citas meklēšanas (cits URL)
+    # redz vēlākos ciklos, un hešs atkarīgs no lapas kolonnām (marka/modelis) - tāpēc neierakstām,
+    # ja pēdējā sludinājuma izmaiņa jau ir uz šo cenu
+    db.executemany('''
+    INSERT INTO ad_changes (ad_id, changed_at, old_price, new_price, old_hash, new_hash)
+    SELECT ad_id, ?, price, ?, content_hash, ? FROM ads WHERE search_id = ? AND ad_id = ?
+    AND (SELECT c.new_price FROM ad_changes c WHERE c.ad_id = ads.ad_id ORDER BY c.rowid DESC LIMIT 1) IS NOT ?
+    ''', change_log)
+    db.executemany('''
+    UPDATE ads SET title = ?, price = ?, url = ?, date_posted = ?, content_hash = ?
+    WHERE search_id = ? AND ad_id = ?
+    ''', changed_rows)
+    # Paziņojumi tiek ierakstīti tajā pašā transakcijā, kur sludinājumi - nepazūd un nedublējas.
+    # Atgriežam to id tādā pašā secībā (None - meklēšana vairs nav mūsu), lai detaļas var papildināt tekstu
+    notification_ids = [db.execute('''
+    INSERT INTO notifications (chat_id, search_id, text, created_at, next_attempt)
+    VALUES (?, ?, ?, ?, ?)
+    ''', row).lastrowid if row[1] in owned else None for row in notifications]
+    # Kontrolpunkts kopā ar sludinājumiem - pēc restarta nospiedums atbilst tam, kas ierakstīts
+    db.executemany('''
+    INSERT INTO search_checkpoints (search_id, url, fingerprint, page_fingerprint, etag, last_modified)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(search_id) DO UPDATE SET url = excluded.url, fingerprint = excluded.fingerprint,
+        page_fingerprint = excluded.page_fingerprint, etag = excluded.etag, last_modified = excluded.last_modified
+    ''', checkpoints)
+    return notification_ids
+
+# Plānotāja stāvoklis (intervāli, nākamās pārbaudes laiks) un last_checked - ik pēc SCHEDULE_SAVE_INTERVAL
+# un apturot, nevis katrā pārbaudē: nemainīga lapa cikla laikā neraksta neko
+def save_schedule(db, rows):
+    db.executemany('''
+    UPDATE search_checkpoints SET rate = ?, interval = ?, last_run = ?, due = ?
+    WHERE search_id = ? AND EXISTS (
+        SELECT 1 FROM searches s WHERE s.search_id = search_checkpoints.search_id AND s.lease_owner = ?)
+    ''', [row + (WORKER_ID,) for row in rows])
+    db.executemany("UPDATE searches SET last_checked = ? WHERE search_id = ? AND lease_owner = ?",
+                   [(datetime.fromtimestamp(row[2]), row[4], WORKER_ID) for row in rows if row[2]])
+
+# Apturot atdodam nomas - restartētais vai cits process tās paņem uzreiz, negaidot LEASE_TTL
+def release_leases(db):
+    db.execute("UPDATE searches SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?", (WORKER_ID,))
+    db.execute("DELETE FROM workers WHERE worker_id = ?", (WORKER_ID,))
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Šī hosta procesi, kas beigušies bez apturēšanas (kill -9, avārija) - to nomas atbrīvojam startā
+def release_dead_workers(db):
+    if os.name != 'posix':
+        return 0
+    released = 0
+    host = socket.gethostname()
+    for (worker_id,) in db.execute("SELECT worker_id FROM workers WHERE worker_id LIKE ?", (host + ':%',)).fetchall():
+        pid = worker_id.rsplit(':', 1)[1]
+        if worker_id != WORKER_ID and pid.isdigit() and not pid_alive(int(pid)):
+            released += db.execute("UPDATE searches SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?",
+                                   (worker_id,)).rowcount
+            db.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+    return released
+
+# Aptur meklēšanas un paziņo lietotājam (vienreiz - tikai tām, kas vēl nav apturētas)
+def pause_searches(db, searches, reason):
+    now = datetime.now()
+    for search in searches:
+        search_id, user_id, category, make, model = search[:5]
+        cursor = db.execute('''
+        UPDATE searches SET paused_at = ?, pause_reason = ?
+        WHERE search_id = ? AND lease_owner = ? AND paused_at IS NULL
+        ''', (now, reason, search_id, WORKER_ID))
+        if cursor.rowcount:
+            metrics.inc('ss_searches_paused_total')
+            title = f"{make} {model}" if model else make
+            text = (f"⏸️ Meklēšana apturēta: {title}\n{reason}.\n\n"
+                    f"Pārbaudiet marku un modeli. Meklēšanu var atsākt vai dzēst ar /mysearches")
+            db.execute("INSERT INTO notifications (chat_id, search_id, text, created_at) VALUES (?, ?, ?, ?)",
+                       (user_id, search_id, text, now))
+
+# Atjauno šī procesa nomas, atdod pārpalikumu vai paņem brīvās/beigušās līdz taisnīgajai daļai
+# Sirdspuksts: pagarina savas nomas (arī cikla vidū, no leases pavediena), atgriež dzīvo worker skaitu
+def renew_heartbeat(db, now):
+    db.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)", (WORKER_ID, now))
+    db.execute("DELETE FROM workers WHERE heartbeat < ?", (now - LEASE_TTL,))
+    db.execute("UPDATE searches SET lease_expires = ? WHERE lease_owner = ?", (now + LEASE_TTL, WORKER_ID))
+    return db.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+
+def renew_leases(db, now):
+    workers = renew_heartbeat(db, now)
+    total = db.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+    fair_share = -(-total // max(workers, 1))
+    owned = db.execute("SELECT COUNT(*) FROM searches WHERE lease_owner = ?", (WORKER_ID,)).fetchone()[0]
+    
+    if owned > fair_share + LEASE_SLACK:
+        db.execute('''
+        UPDATE searches SET lease_owner = NULL, lease_expires = NULL WHERE search_id IN (
+            SELECT search_id FROM searches WHERE lease_owner = ? ORDER BY category DESC, make DESC, model DESC LIMIT ?)
+        ''', (WORKER_ID, owned - fair_share))
+    elif owned < fair_share:
+        # Ņemam pēc markas/modeļa kārtības, lai vienas lapas meklēšanas nonāk vienā procesā
+        db.execute('''
+        UPDATE searches SET lease_owner = ?, lease_expires = ? WHERE search_id IN (
+            SELECT search_id FROM searches WHERE lease_owner IS NULL OR lease_expires < ?
+            ORDER BY category, make, model LIMIT ?)
+        ''', (WORKER_ID, now + LEASE_TTL, now, fair_share - owned))
+    return workers
+
+# Cikla ieraksts neizdevās: atmiņā atjaunojam stāvokli pirms cikla, lai nākamais cikls tos pašus sludinājumus
+# atrastu no jauna (nevis uzskatītu par redzētiem, zaudējot rindas un paziņojumus)
+def rollback_cycle(undo, checkpoints, urls):
+    for search_id, fingerprint, previous in undo:
+        seen_index.restore(search_id, previous)
+        if fingerprint is None:
+            search_fingerprints.pop(search_id, None)
+        else:
+            search_fingerprints[search_id] = fingerprint
+    for row in checkpoints:
+        saved_checkpoints.pop(row[0], None)
+    for url in urls:
+        seen_index.forget(('url', url))
+    metrics.inc('ss_cycle_rollbacks_total')
+    log_event('cycle_rollback', f"Cikla ieraksts neizdevās - atsaukts {len(undo)} meklēšanu stāvoklis", searches=len(undo))
+
+# Viens cikls: apstrādā dotās meklēšanas, atgriež {search_id: jauno sludinājumu skaits}
+# (meklēšanām, kuru lapu neizdevās ielādēt, rezultāta nav)
+def run_cycle(searches):
+    cycle_start = time.perf_counter()
+    plan = plan_fetches(searches)
+    saved_fetches = len(searches) - len(plan)
+    
+    # Jau redzētie sludinājumi katram URL - pēc tiem apstājas lapošana
+    # (broad-crawl režīmā arī visi lapas sludinājumi, kas neder nevienam filtram, zem atslēgas ('url', url))
+    seen_by_url = {}
+    for url, url_searches in plan.items():
+        keys = [search[0] for search in url_searches]
+        if BROAD_CRAWL:
+            keys.append(('url', url))
+        keys = [key for key in keys if seen_index.has_ads(key)]
+        if keys:
+            seen_by_url[url] = lambda ad_id, keys=keys: any(seen_index.is_seen(key, ad_id) for key in keys)
+    
+    # Get current ads from SS.com (vienreiz katram URL, paralēli)
+    scrape_start = time.perf_counter()
+    pages = scrape_urls(plan, seen_by_url)
+    # 304 pēc restarta: sludinājumu atmiņā nav - ja kādai meklēšanai tie vajadzīgi, ielādējam lapu bez ETag
+    reload = [url for url, page in pages.items() if page and page[1] is None
+              and any(search_fingerprints.get(search[0]) != page[0] for search in plan[url])]
+    if reload:
+        for url in reload:
+            page_cache.pop(url, None)
+        pages.update(scrape_urls(reload, seen_by_url))
+    diff_start = time.perf_counter()
+    
+    page_stats = {'parsed': 0, 'unchanged': 0, 'not_modified': 0, 'error': 0}
+    new_rows = []
+    changed_rows = []
+    change_log = {}
+    new_counts = {}
+    notifications = []
+    paused = []
+    checkpoints = []
+    undo = []   # (search_id, iepriekšējais nospiedums, iepriekšējie heši) - ja cikla ieraksts neizdodas
+    
+    for url, url_searches in plan.items():
+        page = pages[url]
+        if page is None:
+            page_stats['error'] += 1
+            # Lapa vairākas reizes pēc kārtas neeksistē - nepareiza marka/modelis, apturam
+            breaker = url_breakers.get(url)
+            if breaker is not None and breaker.kind == 'not_found' and breaker.failures >= INVALID_PAUSE_AFTER:
+                paused += url_searches
+            continue
+        fingerprint, current_ads, status = page
+        page_stats[status] += 1
+        hashes = None
+        matched = None
+        entry = page_cache.get(url) or {}
+        validators = (entry.get('fingerprint'), entry.get('etag'), entry.get('last_modified'))
+        
+        for search in url_searches:
             search_id, user_id, category, make, model, year_from, year_to, price_from, price_to, last_checked = search
+            new_counts[search_id] = 0
             
-            # Get current ads from SS.com
-            current_ads = scrape_ss(category, make, model, year_from, year_to, price_from, price_to)
-            
-            # Get stored ads from DB
-            cursor.execute("SELECT ad_id FROM ads WHERE search_id = ?", (search_id,))
-            stored_ads = [row[0] for row in cursor.fetchall()]
-            
-            # Find new ads
-            new_ads = [ad for ad in current_ads if ad['ad_id'] not in stored_ads]
-            
-            # Save all current ads to DB
-            for ad in current_ads:
-                is_new = ad['ad_id'] in [new_ad['ad_id'] for new_ad in new_ads]
-                cursor.execute('''
-                INSERT OR REPLACE INTO ads (ad_id, search_id, title, price, url, date_posted, is_new)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (ad['ad_id'], search_id, ad['title'], ad['price'], ad['url'], ad['date'], is_new))
+            # Lapa nav mainījusies kopš šīs meklēšanas pēdējās apstrādes - nav ko salīdzināt un rakstīt
+            # (kontrolpunktu tikai, ja lapas ETag/Last-Modified atšķiras no ierakstītajiem)
+            if search_fingerprints.get(search_id) == fingerprint:
+                checkpoint = checkpoint_row(search_id, url, fingerprint, validators)
+                if checkpoint:
+                    checkpoints.append(checkpoint)
+                continue
             
+            if hashes is None:
+                hashes = {ad.ad_id: content_hash(ad) for ad in current_ads}
+                if BROAD_CRAWL:
+                    matched = get_matcher(url, url_searches).match(current_ads)
+                    seen_index.mark_seen(('url', url), hashes)
+            search_ads = matched.get(search_id, []) if BROAD_CRAWL else current_ads
+        
+            # Find new and changed ads (no atmiņas indeksa, bez DB lasīšanas)
+            new_ads = []
+            previous = {}
+            for ad in search_ads:
+                ad_hash = hashes[ad.ad_id]
+                stored = seen_index.lookup(search_id, ad.ad_id)
+                if stored is NOT_SEEN:
+                    previous[ad.ad_id] = NOT_SEEN
+                    new_ads.append(ad)
+                    new_rows.append((ad.ad_id, search_id, ad.title, ad.price, ad.url, ad.date,
+                                     ad_hash))
+                elif stored is not BLOOM_SEEN and stored != ad_hash:
+                    previous[ad.ad_id] = stored
+                    changed_rows.append((ad.title, ad.price, ad.url, ad.date, ad_hash,
+                                         search_id, ad.ad_id))
+                    # Vēsturē katras izmaiņas vienreiz, nevis katrai meklēšanai (vecie ieraksti bez heša - nē)
+                    if stored is not None and ad.ad_id not in change_log:
+                        change_log[ad.ad_id] = (ad.price, ad_hash, search_id, ad.ad_id, ad.price)
+            seen_index.mark_seen(search_id, {ad.ad_id: hashes[ad.ad_id] for ad in search_ads})
+            undo.append((search_id, search_fingerprints.get(search_id), previous))
+            new_counts[search_id] = len(new_ads)
+        
             # Notificē lietotāju par jauniem sludinājumiem
             for ad in new_ads:
-                # Pārbaudām, vai sludinājumā ir derīgi dati
-                if ad['title'] == "No title" and ad['price'] == "No price" and ad['date'] == "No date":
-                # Izlaižam "tukšos" sludinājumus
+                # Izlaižam "tukšos" sludinājumus - vajag vismaz nosaukumu un URL
+                if not ad.title or not ad.url:
                     continue
+                
+                notifications.append((user_id, search_id, ad, url))
+                 
+            search_fingerprints[search_id] = fingerprint
+            checkpoint = checkpoint_row(search_id, url, fingerprint, validators)
+            if checkpoint:
+                checkpoints.append(checkpoint)
+    
+    diff_seconds = time.perf_counter() - diff_start
+    metrics.observe('ss_diff_seconds', diff_seconds)
+    
+    # Zem tirgus cenas - salīdzinām ar visiem zināmajiem tās pašas sadaļas sludinājumiem
+    market = {}
+    if MARKET_DISCOUNT and notifications:
+        snapshots = market_snapshots({listing_section(url) for _, _, _, url in notifications})
+        for _, _, ad, url in notifications:
+            below = snapshots[listing_section(url)].below_market(ad)
+            if below:
+                market[url, ad.ad_id] = below
+        metrics.inc('ss_below_market_total', len(market))
+    
+    # Save ads - viens rakstītāja darbs visam ciklam (last_checked - ar plānotāja stāvokli, save_schedule).
+    # Paziņojumi uzreiz ar saraksta datiem; ar ENRICH_DETAILS tie tiek aizturēti līdz DETAIL_WAIT, kamēr
+    # detail_enricher (ārpus cikla) ielādē sludinājumu lapas un papildina tekstu
+    now = datetime.now()
+    changes = [(now,) + change for change in change_log.values()]
+    details, missing = {}, ()
+    if ENRICH_DETAILS and notifications:
+        details, missing = plan_details(dict.fromkeys(ad.url for _, _, ad, _ in notifications))
+        missing = set(missing)
+    hold = time.time() + DETAIL_WAIT
+    enrich = []
+    rows = []
+    for user_id, search_id, ad, url in notifications:
+        below = market.get((url, ad.ad_id))
+        if ad.url in missing:
+            enrich.append((len(rows), ad, below))
+        rows.append((user_id, search_id, format_ad_message(enrich_ad(ad, details.get(ad.url)), below), now,
+                     hold if ad.url in missing else 0))
+    notifications = rows
+    # Nekas nav mainījies (nemainīgas lapas, 304) - rakstītājam nav darba
+    if new_rows or changed_rows or changes or notifications or checkpoints:
+        future = db_writer.submit(lambda db, new_rows=new_rows, changed_rows=changed_rows, changes=changes,
+                                  notifications=notifications, checkpoints=checkpoints:
+                                  write_cycle(db, new_rows, changed_rows, changes, notifications, checkpoints))
+        future.add_done_callback(lambda future: future.exception() and rollback_cycle(undo, checkpoints, plan))
+        if notifications:
+            future.add_done_callback(lambda _: dispatcher.wake())
+        if enrich:
+            future.add_done_callback(lambda future: future.exception() or detail_enricher.submit(
+                [(future.result()[index], ad, below) for index, ad, below in enrich
+                 if future.result()[index] is not None]))
+    if paused:
+        db_writer.submit(lambda db: pause_searches(db, paused, 'SS.com lapa netika atrasta (404)')
+                         ).add_done_callback(lambda _: dispatcher.wake())
+    
+    for status, count in page_stats.items():
+        metrics.inc('ss_pages_total', count, status=status)
+    metrics.inc('ss_new_ads_total', len(new_rows))
+    metrics.inc('ss_changed_ads_total', len(changed_rows))
+    metrics.inc('ss_cycles_total')
+    cycle_seconds = time.perf_counter() - cycle_start
+    metrics.observe('ss_cycle_seconds', cycle_seconds)
+    
+    fetched = len(plan) - page_stats['error']
+    hit_rate = (page_stats['unchanged'] + page_stats['not_modified']) / fetched if fetched else 0
+    log_event('cycle',
+              f"Cikls: {len(searches)} meklēšanas, {len(plan)} lapas, ietaupīti {saved_fetches} pieprasījumi\n"
+              f"Ieraksti: {len(new_rows)} jauni, {len(changed_rows)} mainīti ({len(changes)} izmaiņas vēsturē)\n"
+              f"Lapas: {page_stats['parsed']} parsētas, {page_stats['unchanged']} nemainīgas, "
+              f"{page_stats['not_modified']} 304, {page_stats['error']} kļūdas (trāpījumi {hit_rate:.0%})",
+              searches=len(searches), pages=len(plan), saved_fetches=saved_fetches,
+              new=len(new_rows), changed=len(changed_rows), history=len(changes), **page_stats,
+              seconds=round(cycle_seconds, 4), scrape_seconds=round(diff_start - scrape_start, 4),
+              diff_seconds=round(diff_seconds, 4))
+    return new_counts
+
+# Pēc restarta vai nomas pārņemšanas: nospiedumi, ETag un plānotāja stāvoklis no kontrolpunktiem,
+# lai pirmais cikls nesalīdzina (un nepaziņo) vēlreiz to, kas jau apstrādāts
+def restore_checkpoints(db, search_ids):
+    search_ids = list(search_ids)
+    restored = 0
+    for i in range(0, len(search_ids), 500):
+        chunk = search_ids[i:i + 500]
+        rows = db.execute(f"""
+        SELECT search_id, url, fingerprint, page_fingerprint, etag, last_modified, rate, interval, last_run, due
+        FROM search_checkpoints WHERE search_id IN ({','.join('?' * len(chunk))})
+        """, chunk).fetchall()
+        for search_id, url, fingerprint, page_print, etag, last_modified, rate, interval, last_run, due in rows:
+            state = scheduler.state.get(search_id)
+            if state is None or state['url'] != url:
+                continue   # URL mainījies - sākam no jauna
+            search_fingerprints[search_id] = fingerprint
+            saved_checkpoints[search_id] = (url, fingerprint, page_print, etag, last_modified)
+            if page_print and url not in page_cache:
+                page_cache[url] = {'etag': etag, 'last_modified': last_modified, 'fingerprint': page_print, 'ads': None}
+            scheduler.restore(search_id, rate, interval, last_run, due)
+            restored += 1
+    return restored
+
+# Atjaunojam nomas un pārlasām savas meklēšanas (jaunas, dzēstas, mainīts abonements)
+schedule_saved_at = 0
+
+def sync_searches(now):
+    global schedule_saved_at
+    if now - schedule_saved_at >= SCHEDULE_SAVE_INTERVAL:
+        schedule_saved_at = now
+        rows = scheduler.checkpoint_rows()
+        if rows:
+            db_writer.submit(lambda db, rows=rows: save_schedule(db, rows))
+    renewed(db_writer.submit(lambda db: renew_leases(db, now)).result(), now)
+    added, removed = scheduler.sync(db_query(f"""
+    SELECT {SEARCH_COLUMNS}, u.subscription_type
+    FROM searches s LEFT JOIN users u ON u.user_id = s.user_id
+    WHERE s.lease_owner = ? AND s.paused_at IS NULL
+    """, (WORKER_ID,)))
+    
+    # Citam procesam nodotās meklēšanas aizmirstam, paņemtajām ielādējam redzētos sludinājumus
+    for search_id in removed:
+        seen_index.forget(search_id)
+    try:
+        seen_index.load(get_read_conn(), added)
+        restored = restore_checkpoints(get_read_conn(), added)
+    except Exception:
+        # Bez redzēto sludinājumu indeksa meklēšana paziņotu visu no jauna - nākamā sinhronizācija to pievienos vēlreiz
+        scheduler.drop(added)
+        raise
+    if restored:
+        log_event('checkpoints', f"Atjaunoti {restored} meklēšanu kontrolpunkti", restored=restored)
+    
+    # Aizmirstam URL un meklēšanas, kuru vairs nav
+    for url in list(page_cache):
+        if url not in scheduler.urls:
+            del page_cache[url]
+            matcher_cache.pop(url, None)
+            seen_index.forget(('url', url))
+    with breakers_lock:
+        for url in list(url_breakers):
+            if url not in scheduler.urls:
+                del url_breakers[url]
+    for search_id in list(search_fingerprints):
+        if search_id not in scheduler.state:
+            del search_fingerprints[search_id]
+    for search_id in list(saved_checkpoints):
+        if search_id not in scheduler.state:
+            del saved_checkpoints[search_id]
+
+# Nomas tiek atjaunotas starp cikliem (sync_searches); ja cikls ilgst ilgāk par SEARCH_REFRESH (lēns SS.com,
+# daudz lapu pie HOST_RATE), šis pavediens pagarina tās cikla laikā, lai tās nepārņem citi procesi
+leases_renewed_at = 0
+
+def renewed(workers, now):
+    global leases_renewed_at
+    leases_renewed_at = now
+    set_host_share(workers)
+
+def keep_leases():
+    interval = min(SEARCH_REFRESH, LEASE_TTL / 3)
+    while not shutdown_event.wait(1.0):
+        now = time.time()
+        if now - leases_renewed_at < interval:
+            continue
+        try:
+            # Pirms rindā gaidošajiem fona darbiem - nomas termiņš ir svarīgāks
+            renewed(db_writer.submit(lambda db: renew_heartbeat(db, now), interactive=True).result(), now)
+        except Exception as e:
+            scraper_error('heartbeat', e)
+
+# Kļūda (piem., "database is locked" no rakstītāja) neaptur scraper pavedienu - to reģistrējam un turpinām
+def scraper_error(stage, error):
+    metrics.inc('ss_scraper_errors_total', stage=stage)
+    log_event('scraper_error', f"Scraper kļūda ({stage}): {error}", stage=stage, error=str(error))
+
+# Check for new ads periodically - katra meklēšana tiek pārbaudīta, kad pienāk tās laiks
+def check_new_ads():
+    last_sync = 0
+    first_cycle = True
+    try:
+        released = db_writer.submit(release_dead_workers).result()
+        if released:
+            log_event('leases_released', f"Atbrīvotas {released} beigušos procesu nomas", released=released)
+    except Exception as e:
+        scraper_error('startup', e)
+    threading.Thread(target=keep_leases, name='leases', daemon=True).start()
+    
+    while not shutdown_event.is_set():
+        now = time.time()
+        if now - last_sync >= SEARCH_REFRESH:
+            try:
+                sync_searches(now)
+                last_sync = now
+            except Exception as e:
+                scraper_error('sync', e)
+                shutdown_event.wait(SCRAPER_ERROR_PAUSE)
+                continue
         
-                # Pārbaudām, vai ir vismaz nosaukums un URL
-                if ad['title'] != "No title" and ad['url']:
-                    emoji = "🟢"  # Zaļš aplis jauniem sludinājumiem
-        
-                    # Veidojam ziņu tikai ar tiem datiem, kas ir pieejami
-                    message = f"{emoji} Jauns sludinājums!\n\n{ad['title']}"
-                    
-                    if ad['year'] != "Nav norādīts":
-                        message += f"\nGads: {ad['year']}"
-
-                    if ad['engine'] != "Nav norādīts":
-                        message += f"\nDzinējs: {ad['engine']}"    
-
-                    if ad['transmission'] != "Nav norādīta":
-                        message += f"\nĀtrumkārba: {ad['transmission']}"
-                        
-                    if ad['price'] != "No price":
-                        message += f"\nCena: {ad['price']}"
-                    
-                    if ad['url']:
-                        message += f"\n\n{ad['url']}"
-            
-                    bot.send_message(user_id, message)
-                     
-            # Update last checked time
-            cursor.execute("UPDATE searches SET last_checked = ? WHERE search_id = ?", (datetime.now(), search_id))
-            conn.commit()
+        due = scheduler.pop_due(now)
+        if not due:
+            shutdown_event.wait(min(1.0, max(0.05, scheduler.next_due() - now)))
+            continue
         
-        time.sleep(30)  # Sekundes pēc cik tiek pārbaudīts
+        try:
+            with profiler.cycle(f"{len(due)} meklēšanas"):
+                new_counts = run_cycle(due)
+        except Exception as e:
+            scraper_error('cycle', e)
+            new_counts = {}   # meklēšanas pārbaudīsim pēc parastā intervāla
+        scheduler.reschedule(due, new_counts, time.time())
+        if first_cycle:
+            first_cycle = False
+            seconds = time.time() - started_at
+            metrics.set('ss_startup_first_cycle_seconds', seconds)
+            log_event('startup', f"Pirmais cikls {seconds:.1f}s pēc starta", first_cycle_seconds=round(seconds, 3))
+    
+    # Apturot: plānotāja stāvoklis kontrolpunktos un nomas atpakaļ (cikla ieraksti jau ir rindā pirms šī)
+    rows = scheduler.checkpoint_rows(everything=True)
+    db_writer.submit(lambda db: save_schedule(db, rows))
+    db_writer.submit(release_leases)
 
-# Start the checking thread
-import threading
-thread = threading.Thread(target=check_new_ads)
-thread.daemon = True
-thread.start()
+# Sūta paziņojumus no notifications tabulas atsevišķā pavedienā: ievēro Telegram limitus,
+# vienam čatam uzkrātos sludinājumus apvieno vienā ziņā, pie 429 gaida retry_after
+class NotificationDispatcher:
+    def __init__(self):
+        self.event = threading.Event()
+        self.bucket = TokenBucket(TELEGRAM_RATE, TELEGRAM_RATE)
+        self.chat_ready = {}   # chat_id -> laiks, kad drīkst sūtīt nākamo ziņu
+        self.thread = None
+        self.first_sent = False
+
+    def wake(self):
+        self.event.set()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='notifier', daemon=True)
+        self.thread.start()
+        self.wake()   # pēc restarta uzkrātos paziņojumus sūtām uzreiz
+
+    def run(self):
+        while not shutdown_event.is_set():
+            self.event.wait(1.0)
+            self.event.clear()
+            try:
+                self.dispatch()
+            except Exception as e:
+                print(f"Notification dispatcher error: {e}")
+
+    # Apturot (pēc tam, kad pavediens beidzis): izsūta, ko var, līdz termiņam; pārējie paliek tabulā
+    def drain(self, deadline):
+        if self.thread is None:
+            return
+        self.thread.join(max(0, deadline - time.time()))
+        while time.time() < deadline:
+            try:
+                if not self.dispatch():
+                    return
+            except Exception as e:
+                print(f"Notification dispatcher error: {e}")
+                return
+            time.sleep(min(TELEGRAM_CHAT_INTERVAL, max(0, deadline - time.time())))
+
+    def dispatch(self):
+        now = time.time()
+        pending = db_query('''
+        SELECT notification_id, chat_id, text, attempts FROM notifications
+        WHERE next_attempt <= ? ORDER BY notification_id LIMIT 1000
+        ''', (now,))
+        
+        metrics.set('ss_notifications_due', len(pending))
+        by_chat = OrderedDict()
+        for row in pending:
+            by_chat.setdefault(row[1], []).append(row)
+        
+        for chat_id, rows in by_chat.items():
+            if self.chat_ready.get(chat_id, 0) > time.time():
+                continue
+            ids, text = self.build_digest(rows)
+            self.bucket.acquire()
+            self.send(chat_id, ids, text, max(row[3] for row in rows if row[0] in ids))
+            self.chat_ready[chat_id] = time.time() + TELEGRAM_CHAT_INTERVAL
+        return len(pending)
+
+    # Apvieno līdz DIGEST_MAX_ADS ziņām (Telegram limits - 4096 simboli)
+    def build_digest(self, rows):
+        ids, texts, length = [], [], 0
+        for notification_id, _chat_id, text, _attempts in rows[:DIGEST_MAX_ADS]:
+            if texts and length + len(text) + 2 > 4096:
+                break
+            ids.append(notification_id)
+            texts.append(text)
+            length += len(text) + 2
+        return ids, "\n\n".join(texts)
+
+    def send(self, chat_id, ids, text, attempts):
+        try:
+            with metrics.timer('ss_telegram_send_seconds'):
+                bot.send_message(chat_id, text)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 5)
+                metrics.inc('ss_telegram_messages_total', result='429')
+                log_event('telegram_429', f"Telegram 429 čatam {chat_id}, gaidām {retry_after}s",
+                          chat_id=chat_id, retry_after=retry_after)
+                self.chat_ready[chat_id] = time.time() + retry_after
+                return
+            if e.error_code in (400, 403):
+                # Lietotājs bloķējis botu vai čats neeksistē - atkārtot nav jēgas
+                metrics.inc('ss_telegram_messages_total', result='dropped')
+                log_event('telegram_dropped', f"Paziņojums čatam {chat_id} atmests: {e.description}",
+                          chat_id=chat_id, error=e.description)
+                self.delete(ids)
+                return
+            self.retry_later(ids, attempts, e)
+            return
+        except Exception as e:
+            self.retry_later(ids, attempts, e)
+            return
+        metrics.inc('ss_telegram_messages_total', result='sent')
+        metrics.inc('ss_telegram_ads_total', len(ids))
+        self.delete(ids)
+        if not self.first_sent:
+            self.first_sent = True
+            seconds = time.time() - started_at
+            metrics.set('ss_startup_first_alert_seconds', seconds)
+            log_event('startup', f"Pirmais paziņojums {seconds:.1f}s pēc starta", first_alert_seconds=round(seconds, 3))
+
+    def retry_later(self, ids, attempts, error):
+        metrics.inc('ss_telegram_messages_total', result='error')
+        if attempts + 1 >= NOTIFY_MAX_ATTEMPTS:
+            print(f"Paziņojumi {ids} atmesti pēc {attempts + 1} mēģinājumiem: {error}")
+            self.delete(ids)
+            return
+        delay = min(300, 5 * 2 ** attempts)
+        print(f"Paziņojumu sūtīšanas kļūda ({error}), atkārtosim pēc {delay}s")
+        db_writer.submit(lambda db: db.executemany(
+            "UPDATE notifications SET attempts = attempts + 1, next_attempt = ? WHERE notification_id = ?",
+            [(time.time() + delay, notification_id) for notification_id in ids])).result()
+
+    def delete(self, ids):
+        db_writer.submit(lambda db: db.executemany(
+            "DELETE FROM notifications WHERE notification_id = ?", [(i,) for i in ids])).result()
+
+dispatcher = NotificationDispatcher()
+
+# Fona uzturēšana ik pēc MAINTENANCE_INTERVAL: vecos sludinājumus pārvieto uz arhīvu, notīra is_new,
+# atbrīvo vietu ar incremental_vacuum un atjauno statistiku. Viss mazos rakstītāja darbos ar pauzēm.
+# Darbojas tikai bota procesā (ne worker procesos).
+class Maintenance:
+    def __init__(self):
+        self.archive = None
+
+    def start(self):
+        if MAINTENANCE_INTERVAL:
+            threading.Thread(target=self.run, name='maintenance', daemon=True).start()
+
+    def run(self):
+        while not shutdown_event.wait(MAINTENANCE_INTERVAL):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Maintenance error: {e}")
+
+    def run_once(self):
+        start = time.perf_counter()
+        archived = self.expire_ads()
+        history = self.expire_changes()
+        cleared = self.clear_new()
+        vacuumed = self.vacuum()
+        log_event('maintenance', f"Uzturēšana: arhivēti {archived} sludinājumi un {history} izmaiņas, "
+                                 f"notīrīti {cleared} is_new, atbrīvotas {vacuumed} lapas "
+                                 f"({time.perf_counter() - start:.1f}s)",
+                  archived=archived, history=history, cleared=cleared, vacuumed=vacuumed)
+
+    def get_archive(self):
+        if self.archive is None:
+            self.archive = sqlite3.connect(ARCHIVE_PATH)
+            self.archive.execute(f"CREATE TABLE IF NOT EXISTS ads_archive {ADS_ARCHIVE_SCHEMA}")
+            migrate_archive_price(self.archive)
+            self.archive.execute('''
+            CREATE TABLE IF NOT EXISTS ad_changes_archive (
+                ad_id TEXT, changed_at TIMESTAMP, old_price INTEGER, new_price INTEGER,
+                old_hash INTEGER, new_hash INTEGER
+            )
+            ''')
+        return self.archive
+
+    # Arhīvā ierakstām pirms dzēšanas: pēc kļūmes starp abiem soļiem rinda var atkārtoties arhīvā, bet nepazūd
+    def archive_rows(self, table, rows):
+        if not ARCHIVE_PATH or not rows:
+            return
+        archive = self.get_archive()
+        with archive:
+            archive.executemany(f"INSERT INTO {table} VALUES ({','.join('?' * len(rows[0]))})", rows)
+
+    # Sludinājums beidzies, ja tas nav starp meklēšanas RETENTION_ADS jaunākajiem un ir vecāks par RETENTION_DAYS
+    def expire_ads(self):
+        cutoff = time.time() - RETENTION_DAYS * 86400 if RETENTION_DAYS else float('inf')
+        archived = 0
+        last_id = 0
+        while True:
+            search_ids = [row[0] for row in db_query(
+                "SELECT search_id FROM searches WHERE search_id > ? ORDER BY search_id LIMIT 100", (last_id,))]
+            if not search_ids:
+                return archived
+            last_id = search_ids[-1]
+            for search_id in search_ids:
+                while True:
+                    rows = db_query('''
+                    SELECT rowid, ad_id, search_id, title, price, url, date_posted, content_hash, first_seen
+                    FROM ads WHERE search_id = ? AND (first_seen IS NULL OR first_seen < ?) AND rowid <= (
+                        SELECT rowid FROM ads WHERE search_id = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?)
+                    LIMIT ?
+                    ''', (search_id, cutoff, search_id, RETENTION_ADS, MAINTENANCE_SLICE))
+                    if not rows:
+                        break
+                    now = time.time()
+                    self.archive_rows('ads_archive', [row[1:] + (now,) for row in rows])
+                    # rowid pārbaude: ja sludinājums tikmēr ierakstīts no jauna, to nedzēšam
+                    db_writer.submit(lambda db, rows=rows: db.executemany(
+                        "DELETE FROM ads WHERE rowid = ? AND search_id = ? AND ad_id = ?",
+                        [(row[0], row[2], row[1]) for row in rows])).result()
+                    archived += len(rows)
+                    metrics.inc('ss_maintenance_archived_total', len(rows), table='ads')
+                    time.sleep(MAINTENANCE_PAUSE)
+
+    # ad_changes tikai pievieno rindas, tāpēc rowid secība = laika secība
+    def expire_changes(self):
+        if not RETENTION_DAYS:
+            return 0
+        cutoff = datetime.now() - timedelta(days=RETENTION_DAYS)
+        archived = 0
+        while True:
+            rows = db_query('''
+            SELECT rowid, ad_id, changed_at, old_price, new_price, old_hash, new_hash FROM ad_changes
+            WHERE changed_at < ? ORDER BY rowid LIMIT ?
+            ''', (cutoff, MAINTENANCE_SLICE))
+            if not rows:
+                return archived
+            self.archive_rows('ad_changes_archive', [row[1:] for row in rows])
+            db_writer.submit(lambda db, rows=rows: db.executemany(
+                "DELETE FROM ad_changes WHERE rowid = ?", [(row[0],) for row in rows])).result()
+            archived += len(rows)
+            metrics.inc('ss_maintenance_archived_total', len(rows), table='ad_changes')
+            time.sleep(MAINTENANCE_PAUSE)
+
+    # Par jaunajiem sludinājumiem jau paziņots iepriekšējā ciklā - karodziņu notīram
+    def clear_new(self):
+        cutoff = time.time() - MAINTENANCE_INTERVAL
+        cleared = 0
+        while True:
+            count = db_writer.submit(lambda db: db.execute('''
+            UPDATE ads SET is_new = 0 WHERE rowid IN (
+                SELECT rowid FROM ads WHERE is_new = 1 AND (first_seen IS NULL OR first_seen < ?) LIMIT ?)
+            ''', (cutoff, MAINTENANCE_SLICE)).rowcount).result()
+            cleared += count
+            if count < MAINTENANCE_SLICE:
+                return cleared
+            time.sleep(MAINTENANCE_PAUSE)
+
+    # Atbrīvotās lapas atdod failu sistēmai pa VACUUM_PAGES lapām; PRAGMA optimize - ierobežots ANALYZE
+    def vacuum(self):
+        def vacuum_step(db):
+            before = db.execute("PRAGMA freelist_count").fetchone()[0]
+            db.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+            return before - db.execute("PRAGMA freelist_count").fetchone()[0]
+        
+        vacuumed = 0
+        if db_query_one("PRAGMA auto_vacuum")[0] == 2:
+            while True:
+                pages = db_writer.submit(vacuum_step).result()
+                if pages <= 0:
+                    break
+                vacuumed += pages
+                time.sleep(MAINTENANCE_PAUSE)
+            metrics.inc('ss_maintenance_vacuumed_pages_total', vacuumed)
+        def analyze(db):
+            db.execute("PRAGMA analysis_limit = 400").fetchall()
+            db.execute("PRAGMA optimize").fetchall()
+        db_writer.submit(analyze).result()
+        db_writer.submit(lambda db: db.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()).result()
+        return vacuumed
+
+maintenance = Maintenance()
 
 # Bot commands
 @bot.message_handler(commands=['start'])
+@timed('start')
 def send_welcome(message):
     user_id = message.from_user.id
     
     # Check if user exists
-    cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
-    if not cursor.fetchone():
-        cursor.execute("INSERT INTO users (user_id) VALUES (?)", (user_id,))
-        conn.commit()
+    if not db_query_one("SELECT 1 FROM users WHERE user_id = ?", (user_id,)):
+        db_writer.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,), interactive=True).result()
     
     bot.reply_to(message, "👋 Sveiki! Šis bots palīdz sekot līdzi jaunajiem sludinājumiem SS.com.\n\nIzmantojiet komandu /search, lai sāktu jaunu meklēšanu.")
 
 @bot.message_handler(commands=['search'])
+@timed('search')
 def start_search(message):
     user_id = message.from_user.id
     
     # Check user's subscription status
-    cursor.execute("SELECT subscription_type FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
+    user = db_query_one("SELECT subscription_type FROM users WHERE user_id = ?", (user_id,))
     
     if user and user[0] == 'free':
         # Check how many searches user already has
-        cursor.execute("SELECT COUNT(*) FROM searches WHERE user_id = ?", (user_id,))
-        search_count = cursor.fetchone()[0]
+        search_count = db_query_one("SELECT COUNT(*) FROM searches WHERE user_id = ?", (user_id,))[0]
         
         if search_count >= 1:  # Free users can have only 1 search
             bot.send_message(user_id, "⚠️ Jūsu bezmaksas konts atļauj tikai vienu meklēšanu. Ja vēlaties pievienot vairāk meklēšanu, iegādājieties Premium vai VIP versiju.",
@@ -241,76 +2622,107 @@ def start_search(message):
             return
     
     # Start search process
-    msg = bot.send_message(user_id, "Lūdzu, ievadiet automašīnas marku (piemēram, Audi, BMW):")
-    bot.register_next_step_handler(msg, process_make_step)
+    ask_category(user_id)
 
-def process_make_step(message):
+# Sadaļas izvēle - tālākie jautājumi un filtri atkarīgi no kategorijas
+def ask_category(user_id):
+    markup = InlineKeyboardMarkup()
+    for key, category in CATEGORIES.items():
+        markup.add(InlineKeyboardButton(category['name'], callback_data=f"category_{key}"))
+    bot.send_message(user_id, "Kurā sadaļā meklēt?", reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('category_'))
+def handle_category_choice(call):
+    user_id = call.from_user.id
+    category = call.data.split('_', 1)[1]
+    if category not in CATEGORIES:
+        bot.answer_callback_query(call.id, "Kļūda: nezināma sadaļa")
+        return
+    bot.answer_callback_query(call.id)
+    msg = bot.send_message(user_id, CATEGORIES[category]['prompts'][0])
+    bot.register_next_step_handler(msg, process_make_step, category)
+
+def process_make_step(message, category='cars'):
     try:
         make = message.text.strip()
         user_id = message.from_user.id
         
-        msg = bot.send_message(user_id, f"Lūdzu, ievadiet modeli markai {make} (piemēram, A4, X5):")
-        bot.register_next_step_handler(msg, process_model_step, make)
+        msg = bot.send_message(user_id, CATEGORIES[category]['prompts'][1].format(make=make))
+        bot.register_next_step_handler(msg, process_model_step, category, make)
     except Exception as e:
         bot.reply_to(message, f"Kļūda: {e}")
 
-def process_model_step(message, make):
+def process_model_step(message, category, make):
     try:
         model = message.text.strip()
+        model = '' if model == '-' else model
         user_id = message.from_user.id
         
+        # Kategorijām bez gada filtra (dzīvokļi, elektronika) uzreiz jautājam cenu
+        if 'year' not in CATEGORIES[category]['filters']:
+            ask_price_filter(user_id, category, make, model, None, None)
+            return
+        
         # Ask if user wants to add year filter
         markup = InlineKeyboardMarkup()
         markup.row(
-            InlineKeyboardButton("Jā", callback_data=f"year_yes_{make}_{model}"),
-            InlineKeyboardButton("Nē", callback_data=f"year_no_{make}_{model}")
+            InlineKeyboardButton("Jā", callback_data=f"year_yes_{category}_{make}_{model}"),
+            InlineKeyboardButton("Nē", callback_data=f"year_no_{category}_{make}_{model}")
         )
         
         bot.send_message(user_id, "Vai vēlaties norādīt gada diapazonu?", reply_markup=markup)
     except Exception as e:
         bot.reply_to(message, f"Kļūda: {e}")
 
+# Callback dati: <prefikss>_<darbība>_<kategorija>_<marka>_<modelis>...
+# Pogām čatos no laika pirms kategorijām kategorijas nav - tās ir 'cars'
+def split_search_callback(data, size):
+    parts = data.split('_')
+    if len(parts) == size - 1 or (len(parts) >= size and parts[2] not in CATEGORIES):
+        parts.insert(2, 'cars')
+    if len(parts) < size:
+        raise ValueError("Nepilni callback dati")
+    return parts
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith('year_'))
 def handle_year_choice(call):
     try:
         print(f"Callback received: {call.data}")  # Atkļūdošana
         user_id = call.from_user.id
-        parts = call.data.split('_')
+        parts = split_search_callback(call.data, 5)
         print(f"Parts: {parts}")  # Atkļūdošana
         
-        if len(parts) < 4:
-            raise ValueError("Nepilni callback dati")
-            
         action = parts[1]
-        make = parts[2]
-        model = parts[3]
+        category = parts[2]
+        make = parts[3]
+        model = parts[4]
         
         if action == 'yes':
             msg = bot.send_message(user_id, "Lūdzu, ievadiet gada diapazonu formātā 'no līdz' (piemēram, 2010 2020):")
-            bot.register_next_step_handler(msg, process_year_step, make, model)
+            bot.register_next_step_handler(msg, process_year_step, category, make, model)
         else:
-            ask_price_filter(user_id, make, model, None, None)
+            ask_price_filter(user_id, category, make, model, None, None)
     except Exception as e:
         error_msg = f"Kļūda: {str(e)}\nCallback data: {call.data}"
         print(error_msg)  # Konsoles log
         bot.send_message(user_id, error_msg)
 
-def process_year_step(message, make, model):
+def process_year_step(message, category, make, model):
     try:
         year_input = message.text.strip().split()
         year_from = int(year_input[0]) if len(year_input) > 0 else None
         year_to = int(year_input[1]) if len(year_input) > 1 else None
         user_id = message.from_user.id
         
-        ask_price_filter(user_id, make, model, year_from, year_to)
+        ask_price_filter(user_id, category, make, model, year_from, year_to)
     except Exception as e:
         bot.reply_to(message, f"Kļūda: {e}. Lūdzu, ievadiet gada diapazonu formātā 'no līdz' (piemēram, 2010 2020)")
 
-def ask_price_filter(user_id, make, model, year_from, year_to):
+def ask_price_filter(user_id, category, make, model, year_from, year_to):
     markup = InlineKeyboardMarkup()
     markup.row(
-        InlineKeyboardButton("Jā", callback_data=f"price_yes_{make}_{model}_{year_from or ''}_{year_to or ''}"),
-        InlineKeyboardButton("Nē", callback_data=f"price_no_{make}_{model}_{year_from or ''}_{year_to or ''}")
+        InlineKeyboardButton("Jā", callback_data=f"price_yes_{category}_{make}_{model}_{year_from or ''}_{year_to or ''}"),
+        InlineKeyboardButton("Nē", callback_data=f"price_no_{category}_{make}_{model}_{year_from or ''}_{year_to or ''}")
     )
     
     bot.send_message(user_id, "Vai vēlaties norādīt cenas diapazonu?", reply_markup=markup)
@@ -319,36 +2731,38 @@ def ask_price_filter(user_id, make, model, year_from, year_to):
 def handle_price_choice(call):
     try:
         user_id = call.from_user.id
-        parts = call.data.split('_')
+        parts = split_search_callback(call.data, 7)
         print(f"Debug: {parts}")  # Atkļūdošanai
-        
-        # Pārbaudām, vai ir pietiekami daudz daļu
-        if len(parts) < 6:
-            raise ValueError(f"Nepilni callback dati: {call.data}")
             
         action = parts[1]
-        make = parts[2]
-        model = parts[3]
+        category = parts[2]
+        make = parts[3]
+        model = parts[4]
         
         # Apstrādājam gada diapazonu
-        year_from = None if parts[4] in ('', 'null', 'None') else int(parts[4])
-        year_to = None if parts[5] in ('', 'null', 'None') else int(parts[5])
+        year_from = None if parts[5] in ('', 'null', 'None') else int(parts[5])
+        year_to = None if parts[6] in ('', 'null', 'None') else int(parts[6])
         
         if action == 'yes':
             msg = bot.send_message(user_id, 
                 "Lūdzu, ievadiet cenas diapazonu EUR formātā 'no līdz' (piemēram: 5000 15000):")
-            bot.register_next_step_handler(msg, process_price_step, make, model, year_from, year_to)
+            bot.register_next_step_handler(msg, process_price_step, category, make, model, year_from, year_to)
         else:
             # Saglabājam meklēšanu bez cenas filtra
-            save_search(user_id, 'cars', make, model, year_from, year_to, None, None)
+            save_search(user_id, category, make, model, year_from, year_to, None, None)
             
             # Sastādām skaidru atbildi
+            levels = CATEGORIES[category]['levels']
             year_info = f"{year_from}-{year_to}" if year_from or year_to else "nav norādīts"
             response = (
                 f"✅ Meklēšana saglabāta!\n\n"
-                f"🔹 Marka: {make}\n"
-                f"🔹 Modelis: {model}\n"
-                f"🔹 Gadu diapazons: {year_info}\n"
+                f"🔹 Sadaļa: {CATEGORIES[category]['name']}\n"
+                f"🔹 {levels[0]}: {make}\n"
+                f"🔹 {levels[1]}: {model or 'visi'}\n"
+            )
+            if 'year' in CATEGORIES[category]['filters']:
+                response += f"🔹 Gadu diapazons: {year_info}\n"
+            response += (
                 f"🔹 Cenas diapazons: nav filtra\n\n"
                 f"Jūs saņemsit paziņojumus par jauniem sludinājumiem!"
             )
@@ -358,26 +2772,28 @@ def handle_price_choice(call):
         print(f"Kļūda handle_price_choice: {e}\nDati: {call.data}")
         bot.send_message(user_id, "⚠️ Radās kļūda. Lūdzu, mēģiniet vēlreiz ar /search")
 
-def process_price_step(message, make, model, year_from, year_to):
+def process_price_step(message, category, make, model, year_from, year_to):
     try:
         price_input = message.text.strip().split()
         price_from = int(price_input[0]) if len(price_input) > 0 else None
         price_to = int(price_input[1]) if len(price_input) > 1 else None
         user_id = message.from_user.id
         
-        save_search(user_id, 'cars', make, model, year_from, year_to, price_from, price_to)
+        save_search(user_id, category, make, model, year_from, year_to, price_from, price_to)
     except Exception as e:
         bot.reply_to(message, f"Kļūda: {e}. Lūdzu, ievadiet cenas diapazonu formātā 'no līdz' (piemēram, 5000 15000)")
 
 def save_search(user_id, category, make, model, year_from, year_to, price_from, price_to):
-    cursor.execute('''
+    db_writer.execute('''
     INSERT INTO searches (user_id, category, make, model, year_from, year_to, price_from, price_to, last_checked)
     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, category, make, model, year_from, year_to, price_from, price_to, datetime.now()))
-    conn.commit()
+    ''', (user_id, category, make, model, year_from, year_to, price_from, price_to, datetime.now()),
+    interactive=True).result()
     
     # Get the search details for confirmation message
-    search_details = f"Marka: {make}\nModelis: {model}"
+    definition = get_category(category)
+    search_details = (f"Sadaļa: {definition['name']}\n{definition['levels'][0]}: {make}\n"
+                      f"{definition['levels'][1]}: {model or 'visi'}")
     if year_from or year_to:
         search_details += f"\nGadi: {year_from or '?'} - {year_to or '?'}"
     if price_from or price_to:
@@ -404,31 +2820,37 @@ def handle_subscription(call):
     # For demonstration, we'll just update the user's subscription status
     
     if plan == 'premium':
-        cursor.execute("UPDATE users SET subscription_type = 'premium' WHERE user_id = ?", (user_id,))
-        conn.commit()
+        db_writer.execute("UPDATE users SET subscription_type = 'premium' WHERE user_id = ?", (user_id,),
+                          interactive=True).result()
         bot.send_message(user_id, "Paldies par Premium abonementa iegādi! Tagad varat pievienot līdz 3 meklēšanām.")
     elif plan == 'vip':
-        cursor.execute("UPDATE users SET subscription_type = 'vip' WHERE user_id = ?", (user_id,))
-        conn.commit()
+        db_writer.execute("UPDATE users SET subscription_type = 'vip' WHERE user_id = ?", (user_id,),
+                          interactive=True).result()
         bot.send_message(user_id, "Paldies par VIP abonementa iegādi! Tagad varat pievienot neierobežotu skaitu meklēšanu.")
 
 # Izmainītā funkcija kas parāda meklēšanas ar dzēšanas pogām
 @bot.message_handler(commands=['mysearches'])
+@timed('mysearches')
 def show_searches(message):
     user_id = message.from_user.id
     
-    cursor.execute("SELECT * FROM searches WHERE user_id = ?", (user_id,))
-    searches = cursor.fetchall()
+    # Viens vaicājums pa idx_searches_user; sludinājumu skaits - pa ads primārās atslēgas (search_id, ad_id) indeksu
+    searches = db_query('''
+    SELECT s.search_id, s.category, s.make, s.model, s.year_from, s.year_to, s.price_from, s.price_to,
+           s.last_checked, s.pause_reason, (SELECT COUNT(*) FROM ads a WHERE a.search_id = s.search_id)
+    FROM searches s WHERE s.user_id = ? ORDER BY s.search_id
+    ''', (user_id,))
     
     if not searches:
         bot.send_message(user_id, "Jums nav saglabātu meklēšanu. Izmantojiet /search, lai sāktu jaunu meklēšanu.")
         return
     
     for search in searches:
-        search_id, _, category, make, model, year_from, year_to, price_from, price_to, last_checked = search
+        (search_id, category, make, model, year_from, year_to, price_from, price_to,
+         last_checked, pause_reason, ad_count) = search
         
         # Izveido aprakstu ar visiem saglabātajiem parametriem
-        search_info = f"🔍 {make} {model}"
+        search_info = f"🔍 {get_category(category)['name']}: {make} {model}"
         year_info = ""
         if year_from or year_to:
             year_info = f"Gadi: {year_from or 'jebkurš'}-{year_to or 'jebkurš'}"
@@ -444,34 +2866,41 @@ def show_searches(message):
         if price_info:
             details += f"{price_info}\n"
         
+        details += f"Atrasti sludinājumi: {ad_count}\n"
+        
         # Pievienojam pēdējās pārbaudes laiku
         if last_checked:
             details += f"Pēdējā pārbaude: {last_checked}\n"
+        if pause_reason:
+            details += f"⏸️ Apturēta: {pause_reason}\n"
         
-        # Izveido pogu dzēšanai
+        # Izveido pogu dzēšanai (un atsākšanai, ja apturēta)
         markup = InlineKeyboardMarkup()
+        if pause_reason:
+            markup.add(InlineKeyboardButton("▶️ Atsākt meklēšanu", callback_data=f"resume_search_{search_id}"))
         markup.add(InlineKeyboardButton("🗑️ Dzēst šo meklēšanu", callback_data=f"delete_search_{search_id}"))
         
         bot.send_message(user_id, details, reply_markup=markup)
 
 # Jauna funkcija kas apstrādā dzēšanas pogas nospiešanu
 @bot.callback_query_handler(func=lambda call: call.data.startswith('delete_search_'))
+@timed('delete_search')
 def handle_delete_search(call):
     try:
         user_id = call.from_user.id
         search_id = int(call.data.split('_')[2])
         
         # Pārbaudām, vai šī meklēšana pieder lietotājam (drošībai)
-        cursor.execute("SELECT user_id FROM searches WHERE search_id = ?", (search_id,))
-        result = cursor.fetchone()
+        result = db_query_one("SELECT user_id FROM searches WHERE search_id = ?", (search_id,))
         
         if result and result[0] == user_id:
-            # Vispirms dzēšam visus sludinājumus, kas saistīti ar šo meklēšanu
-            cursor.execute("DELETE FROM ads WHERE search_id = ?", (search_id,))
-            
-            # Tad dzēšam pašu meklēšanu
-            cursor.execute("DELETE FROM searches WHERE search_id = ?", (search_id,))
-            conn.commit()
+            # Vispirms dzēšam visus sludinājumus, kas saistīti ar šo meklēšanu, tad pašu meklēšanu
+            def delete_search(db):
+                db.execute("DELETE FROM ads WHERE search_id = ?", (search_id,))
+                db.execute("DELETE FROM search_checkpoints WHERE search_id = ?", (search_id,))
+                db.execute("DELETE FROM searches WHERE search_id = ?", (search_id,))
+            db_writer.submit(delete_search, interactive=True).result()
+            seen_index.forget(search_id)
             
             # Atjaunojam ziņojumu, lai parādītu, ka dzēšana ir veiksmīga
             bot.edit_message_text(
@@ -490,26 +2919,50 @@ def handle_delete_search(call):
         print(f"Kļūda dzēšot meklēšanu: {e}")
         bot.answer_callback_query(call.id, "Notika kļūda. Lūdzu, mēģiniet vēlreiz.")
 
+# Apturētas meklēšanas atsākšana (piem., ja SS.com lapa bija īslaicīgi nepieejama)
+@bot.callback_query_handler(func=lambda call: call.data.startswith('resume_search_'))
+@timed('resume_search')
+def handle_resume_search(call):
+    try:
+        user_id = call.from_user.id
+        search_id = int(call.data.split('_')[2])
+        
+        updated = db_writer.execute('''
+        UPDATE searches SET paused_at = NULL, pause_reason = NULL WHERE search_id = ? AND user_id = ?
+        ''', (search_id, user_id), interactive=True).result()
+        
+        if updated:
+            bot.edit_message_text(
+                "▶️ Meklēšana atsākta!",
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id
+            )
+        else:
+            bot.answer_callback_query(call.id, "Kļūda: Meklēšana netika atrasta vai nav jūsu!")
+    except Exception as e:
+        print(f"Kļūda atsākot meklēšanu: {e}")
+        bot.answer_callback_query(call.id, "Notika kļūda. Lūdzu, mēģiniet vēlreiz.")
+
 # Papildu funkcija jaunas meklēšanas sākšanai no pogas
 @bot.callback_query_handler(func=lambda call: call.data == "start_new_search")
 def start_new_search_callback(call):
     # Tā vietā, lai izsauktu start_search() ar ziņas objektu,
     # mēs vienkārši turpinām procesu ar jaunu ziņu
     user_id = call.from_user.id
-    msg = bot.send_message(user_id, "Lūdzu, ievadiet automašīnas marku (piemēram, Audi, BMW):")
-    bot.register_next_step_handler(msg, process_make_step)
+    ask_category(user_id)
     
     # Atbildam uz callback, lai pazustu "pulkstenis"
     bot.answer_callback_query(call.id)
 
 @bot.message_handler(commands=['help'])
+@timed('help')
 def send_help(message):
     help_text = """
 🆘 SS.com Tracker - Palīdzība
 
 Komandas:
 /start - Sākt darbu ar botu
-/search - Pievienot jaunu meklēšanu
+/search - Pievienot jaunu meklēšanu (auto, motocikli, dzīvokļi, elektronika)
 /mysearches - Apskatīt savas meklēšanas
 /help - Šī palīdzība
 
@@ -522,5 +2975,153 @@ Jaunie sludinājumi tiks atzīmēti ar 🟢 (zaļu bumbiņu)
 """
     bot.send_message(message.chat.id, help_text)
 
-# Start the bot
-bot.polling()
+# Webhook režīms: HTTP serveris tikai pieņem atjauninājumus; apdarinātāji izpildās
+# bota pavedienu pūlā (HANDLER_THREADS), katrs pavediens ar savu DB lasīšanas savienojumu
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != (urlparse(WEBHOOK_URL).path or '/'):
+            self.send_error(404)
+            return
+        if WEBHOOK_SECRET and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            self.send_error(403)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            update = Update.de_json(body.decode('utf-8'))
+        except Exception as e:
+            print(f"Webhook: nederīgs atjauninājums: {e}")
+            self.send_error(400)
+            return
+        metrics.inc('ss_webhook_updates_total')
+        bot.process_new_updates([update])
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def run_webhook():
+    server = ThreadingHTTPServer((WEBHOOK_LISTEN, WEBHOOK_PORT), WebhookHandler)
+    server.daemon_threads = True
+    if WEBHOOK_CERT:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(WEBHOOK_CERT, WEBHOOK_KEY or None)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    
+    bot.remove_webhook()
+    # Pašparakstītu sertifikātu nosūtām Telegram kopā ar webhook reģistrāciju
+    with open(WEBHOOK_CERT, 'rb') if WEBHOOK_CERT else nullcontext() as certificate:
+        bot.set_webhook(url=WEBHOOK_URL, certificate=certificate, secret_token=WEBHOOK_SECRET or None,
+                        max_connections=HANDLER_THREADS)
+    print(f"Webhook: {WEBHOOK_URL} -> {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+    threading.Thread(target=server.serve_forever, name='webhook', daemon=True).start()
+    # Webhook paliek reģistrēts - Telegram atjauninājumus uzkrāj un piegādā restartētajam procesam
+    shutdown_event.wait()
+    server.shutdown()
+
+# Long polling pieprasījums var ilgt ~20s - negaidām to, neapstiprinātie atjauninājumi pienāks pēc restarta
+def run_polling():
+    def poll():
+        bot.polling()
+        request_shutdown()   # polling beidzās kļūdas dēļ - apturam visu procesu kā agrāk
+    
+    bot.remove_webhook()
+    threading.Thread(target=poll, name='polling', daemon=True).start()
+    shutdown_event.wait()
+
+def request_shutdown(signum=None, frame=None):
+    if not shutdown_event.is_set():
+        print("Apturēšana: pabeidzam ciklu, izsūtām paziņojumus un ierakstām datubāzi")
+        shutdown_event.set()
+        dispatcher.wake()
+        bot.stop_polling()
+
+def install_signal_handlers():
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+# Tikai scraper process (bez Telegram komandām) - var palaist vairākus, arī uz citiem hostiem
+def run_worker(index=0):
+    install_signal_handlers()
+    init_app()
+    print(f"Scraper worker {WORKER_ID} startē")
+    start_metrics_server(METRICS_PORT + index if METRICS_PORT else 0)
+    check_new_ads()
+    db_writer.stop(SHUTDOWN_TIMEOUT)
+
+if __name__ == '__main__':
+    # python bot.py            - bots, paziņojumi un scraper vienā procesā
+    # python bot.py bot        - tikai bots un paziņojumi (scraper darbojas atsevišķos worker procesos)
+    # python bot.py worker [N] - N scraper procesi
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    
+    if mode == 'worker':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        if count == 1:
+            run_worker()
+            sys.exit(0)
+        # spawn: katrs process pats atver savus DB savienojumus un pavedienus
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=run_worker, args=(i + 1,)) for i in range(count)]
+        started = [time.time()] * count
+        install_signal_handlers()
+        for process in processes:
+            process.start()
+        # Process, kas beidzās pats, restartējam (citi turpina; tā nomas pārņem pēc LEASE_TTL vai jaunais process)
+        while not shutdown_event.wait(1.0):
+            for i, process in enumerate(processes):
+                if not process.is_alive() and time.time() - started[i] >= WORKER_RESTART_DELAY:
+                    log_event('worker_exit', f"Scraper worker {i + 1} beidzās (kods {process.exitcode}), restartējam",
+                              index=i + 1, exitcode=process.exitcode)
+                    processes[i] = context.Process(target=run_worker, args=(i + 1,))
+                    processes[i].start()
+                    started[i] = time.time()
+        # Apturot nosūtām SIGTERM katram procesam - tie beidz savu ciklu paši
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        sys.exit(0)
+    
+    if mode == 'vacuum':
+        # Vienreizējs pilns VACUUM, lai esoša datubāze pārietu uz auto_vacuum = INCREMENTAL (botam jābūt apturētam)
+        db = connect_db()
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+        print(f"{DB_PATH}: auto_vacuum = {db.execute('PRAGMA auto_vacuum').fetchone()[0]}")
+        sys.exit(0)
+    
+    install_signal_handlers()
+    init_app()
+    start_metrics_server()
+    
+    threads = []
+    if mode == 'all':
+        # Start the checking thread
+        thread = threading.Thread(target=check_new_ads, name='scraper')
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    
+    # Start the notification sender
+    dispatcher.start()
+    maintenance.start()
+    
+    # Start the bot (atgriežas pēc request_shutdown)
+    if WEBHOOK_URL:
+        run_webhook()
+    else:
+        run_polling()
+    
+    # Graceful shutdown: cikls beidzas, tā ieraksti un paziņojumi tiek izsūtīti, rakstītājs iztukšots
+    deadline = time.time() + SHUTDOWN_TIMEOUT
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
+    try:
+        db_writer.flush(max(0, deadline - time.time()))
+    except Exception as e:
+        print(f"DB writer flush error: {e}")
+    dispatcher.drain(deadline)
+    db_writer.stop(max(0, deadline - time.time()))
+    log_event('shutdown', f"Apturēts ({SHUTDOWN_TIMEOUT - max(0, deadline - time.time()):.1f}s)")